@@ -0,0 +1,74 @@
+"""Vectorized anomaly detection against TimeGPT prediction intervals."""
+# Import required libraries
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+# Columns of the anomaly table returned by detect_anomalies.
+ANOMALY_COLUMNS = ['group', 'date', 'y', 'value', 'lo', 'hi', 'direction', 'severity']
+
+
+def interval_frame(results, key):
+    """Build a date x group matrix of one field (e.g. ``'hi-90'``) of per-group TimeGPT results.
+
+    ``results`` maps each group to a TimeGPT response, i.e. ``{'data': {'timestamp': [...], key: [...]}}``.
+    """
+    return pd.DataFrame({
+        group: pd.Series(result['data'][key], index=pd.to_datetime(result['data']['timestamp']), dtype=float)
+        for group, result in results.items()
+    })
+
+
+def empty_anomalies():
+    """Return an anomaly table without rows, with the dtypes of a non-empty one."""
+    return pd.DataFrame(columns=ANOMALY_COLUMNS).astype(
+        {'date': 'datetime64[ns]', 'y': float, 'value': float, 'lo': float, 'hi': float, 'severity': float}
+    )
+
+
+def detect_anomalies(actuals, results, level=90):
+    """Flag the points of every series that fall outside their prediction interval.
+
+    ``actuals`` is a date x group matrix (as returned by ``transform_data``)
+    and ``results`` maps the groups to their in-sample TimeGPT responses. All
+    the series are aligned on their dates and scored at once. A point above
+    ``hi-<level>`` is a spike and a point below ``lo-<level>`` is a drop. The
+    severity is the distance outside the interval divided by the interval
+    width; when the width is zero the raw distance is used.
+
+    Returns a table with one row per anomaly and the columns ``ANOMALY_COLUMNS``,
+    sorted by group and date.
+    """
+    with instrumentation.span('detect_anomalies', series=actuals.shape[1], points=actuals.size) as span:
+        groups = [group for group in actuals.columns if group in results]
+        if not groups:
+            return empty_anomalies()
+        results = {group: results[group] for group in groups}
+
+        # Align the predictions and intervals on the dates of the actuals
+        value = interval_frame(results, 'value').reindex(index=actuals.index, columns=groups).to_numpy()
+        lo = interval_frame(results, f'lo-{level}').reindex(index=actuals.index, columns=groups).to_numpy()
+        hi = interval_frame(results, f'hi-{level}').reindex(index=actuals.index, columns=groups).to_numpy()
+        y = actuals[groups].to_numpy(dtype=float)
+
+        # Comparisons with NaN are False, so dates without a prediction are never flagged
+        with np.errstate(invalid='ignore'):
+            above = y > hi
+            below = y < lo
+        distance = np.where(above, y - hi, np.where(below, lo - y, 0.0))
+        width = hi - lo
+        severity = distance / np.where(width > 0, width, 1.0)
+
+        rows, cols = np.nonzero(above | below)
+        span.set(anomalies=len(rows))
+        return pd.DataFrame({
+            'group': np.asarray(groups, dtype=object)[cols],
+            'date': actuals.index[rows],
+            'y': y[rows, cols],
+            'value': value[rows, cols],
+            'lo': lo[rows, cols],
+            'hi': hi[rows, cols],
+            'direction': np.where(above[rows, cols], 'spike', 'drop'),
+            'severity': severity[rows, cols],
+        }).sort_values(['group', 'date'], ignore_index=True)
@@ -0,0 +1,4 @@
+"""Offline benchmarks of the cost forecasting pipeline.
+
+Run them with ``python -m benchmarks.run``; see the README for the options.
+"""
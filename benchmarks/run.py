@@ -0,0 +1,210 @@
+"""Benchmark the pipeline on synthetic data against the local stub APIs.
+
+    python -m benchmarks.run --scales small medium --repeat 3 --json results.json
+
+Every benchmark reports its best wall time over ``--repeat`` runs, the
+throughput in cost rows (or points) per second and the peak memory traced
+by ``tracemalloc`` during one extra run. No network access or API keys are
+needed: the Vantage, TimeGPT and chat completion APIs are served by
+``benchmarks.stubs`` and every on-disk store lives in a temporary directory.
+"""
+# Import required libraries
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.stubs import StubServer, forecast_series
+from benchmarks.synthetic import generate_costs
+
+# Number of groups and days of cost history of each scale.
+SCALES = {
+    'small': (10, 90),
+    'medium': (100, 365),
+    'large': (500, 730),
+}
+
+# Grouping used by the benchmarks; every synthetic group has its own service.
+GROUPING = 'service'
+
+# Number of group charts drawn by the plotting benchmark.
+PLOTTED_GROUPS = 10
+
+
+def measure(fn, repeat):
+    """Return the best wall time of ``fn`` over ``repeat`` runs and its peak traced memory in bytes."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def insample_results(matrix):
+    """Return stub in-sample answers for every group of a date x group matrix, as the pipeline would get them."""
+    dates = matrix.index.strftime('%Y-%m-%d').tolist()
+    return {group: {'data': forecast_series(dates, matrix[group].to_numpy(), 0, [90], insample=True)} for group in matrix.columns}
+
+
+class Benchmarks:
+    """The benchmarks of one scale, sharing its synthetic payload and stub server."""
+
+    def __init__(self, scale, stub, workdir):
+        import pipeline
+
+        self.pipeline = pipeline
+        self.scale = scale
+        self.n_groups, self.n_days = SCALES[scale]
+        self.costs = generate_costs(self.n_groups, self.n_days, start=pipeline.DEFAULT_START_DATE)
+        self.rows = len(self.costs['costs'])
+        self.stub = stub
+        self.workdir = workdir
+        self.report_id = f'synthetic-{scale}'
+        stub.reports[self.report_id] = self.costs
+
+        self.matrix = pipeline.transform_data(GROUPING, self.costs)
+        self.insample = insample_results(self.matrix)
+        self.anomalies = pipeline.detect_anomalies(self.matrix, self.insample)
+
+    def transform(self):
+        self.pipeline.transform_data(GROUPING, self.costs)
+
+    def calendar(self):
+        from calendar_features import _calendar_matrix, _exogenous_payload
+
+        # Measure the engine itself, not its memoization
+        _calendar_matrix.cache_clear()
+        _exogenous_payload.cache_clear()
+        self.pipeline.exogenous_payload(self.matrix.index[0], self.n_days + 30)
+
+    def anomaly_detection(self):
+        self.pipeline.detect_anomalies(self.matrix, self.insample)
+
+    def local_engine(self):
+        self.pipeline.forecast_groups(self.matrix, engine='local')
+        self.pipeline.forecast_groups(self.matrix, insample=True, engine='local')
+
+    def plotting(self):
+        from plotting import add_confidence_interval_anomalies, add_trace, create_figure
+
+        for group in self.matrix.columns[:PLOTTED_GROUPS]:
+            data = self.insample[group]['data']
+            anomalies = self.anomalies[self.anomalies['group'] == group]
+            fig = create_figure(f'{group} cost', 'Date', 'Cost')
+            fig = add_trace(fig, self.matrix.index, self.matrix[group], 'lines', 'Cost', keep=anomalies['date'])
+            add_confidence_interval_anomalies(fig, data['timestamp'], data['lo-90'], data['hi-90'], anomalies)
+            fig.to_json()
+
+    def reset_stores(self):
+        """Forget every cached cost, forecast, explanation and coalesced result, in memory and on disk."""
+        stores = (self.pipeline.get_cost_store, self.pipeline.get_forecast_cache, self.pipeline.get_explainer, self.pipeline.get_single_flight)
+        for getter in stores:
+            getter.cache_clear()
+        for name in os.listdir(self.workdir):
+            os.remove(os.path.join(self.workdir, name))
+
+    def run_report(self):
+        return self.pipeline.run_report('stub-token', self.report_id, GROUPING, self.pipeline.DEFAULT_START_DATE)
+
+    def pipeline_cold(self):
+        self.reset_stores()
+        self.run_report()
+
+    def pipeline_warm(self):
+        self.run_report()
+
+    def run(self, repeat):
+        """Run every benchmark of the scale and return one result dict per benchmark."""
+        points = self.n_groups * self.n_days
+        plotted = min(self.n_groups, PLOTTED_GROUPS) * self.n_days
+        benchmarks = [
+            ('transform_data', self.transform, self.rows),
+            ('calendar_features', self.calendar, self.n_days + 30),
+            ('detect_anomalies', self.anomaly_detection, points),
+            ('local_forecast', self.local_engine, points),
+            ('plotting', self.plotting, plotted),
+            ('pipeline_cold', self.pipeline_cold, self.rows),
+            ('pipeline_warm', self.pipeline_warm, self.rows),
+        ]
+        results = []
+        for name, fn, size in benchmarks:
+            requests_before = dict(self.stub.requests)
+            seconds, peak = measure(fn, repeat)
+            results.append({
+                'benchmark': name,
+                'scale': self.scale,
+                'groups': self.n_groups,
+                'days': self.n_days,
+                'size': size,
+                'seconds': seconds,
+                'throughput': size / seconds if seconds else float('inf'),
+                'peak_mib': peak / 2 ** 20,
+                'requests': {api: self.stub.requests[api] - requests_before[api] for api in requests_before},
+            })
+        return results
+
+
+def configure(stub, workdir):
+    """Point the pipeline at the stub APIs and at temporary stores; must run before ``pipeline`` is imported."""
+    urls = stub.urls()
+    for name in ('VANTAGE_API_URL', 'LTM1_PROD', 'INSAMPLE_LTM_URL_PROD', 'LTM_MULTI_SERIES_URL_PROD', 'INSAMPLE_LTM_MULTI_SERIES_URL_PROD'):
+        os.environ[name] = urls[name]
+    os.environ['VANTAGE_COST_STORE'] = os.path.join(workdir, 'costs.sqlite')
+    os.environ['VANTAGE_FORECAST_CACHE'] = os.path.join(workdir, 'forecasts.sqlite')
+    os.environ['VANTAGE_EXPLANATION_CACHE'] = os.path.join(workdir, 'explanations.sqlite')
+    os.environ['NIXTLA_TOKEN_PROD'] = os.environ['OPENAI_TOKEN'] = 'stub'
+
+    import openai
+    openai.api_base = urls['OPENAI_API_BASE']
+
+
+def print_table(results):
+    table = pd.DataFrame(results)[['scale', 'benchmark', 'size', 'seconds', 'throughput', 'peak_mib']]
+    print(table.to_string(index=False, formatters={
+        'seconds': '{:.4f}'.format, 'throughput': '{:,.0f}/s'.format, 'peak_mib': '{:.1f} MiB'.format,
+    }))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the cost forecasting pipeline offline.')
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small', 'medium'], help='scales to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark; the best one is reported')
+    parser.add_argument('--vantage-latency', type=float, default=0.0, help='seconds per stub Vantage request')
+    parser.add_argument('--timegpt-latency', type=float, default=0.0, help='seconds per stub TimeGPT request')
+    parser.add_argument('--openai-latency', type=float, default=0.0, help='seconds per stub chat completion request')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    latency = {'vantage': args.vantage_latency, 'timegpt': args.timegpt_latency, 'openai': args.openai_latency}
+    workdir = tempfile.mkdtemp(prefix='vantage-benchmarks-')
+    try:
+        with StubServer(latency=latency) as stub:
+            configure(stub, workdir)
+            results = []
+            for scale in args.scales:
+                results.extend(Benchmarks(scale, stub, workdir).run(args.repeat))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
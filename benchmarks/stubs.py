@@ -0,0 +1,265 @@
+"""Local stand-ins for the Vantage, TimeGPT and chat completion APIs.
+
+A single threaded HTTP server answers all three APIs under their own path
+prefix, each after a configurable latency, so the pipeline can be exercised
+end to end without network access or API keys::
+
+    python -m benchmarks.stubs --port 8765 --groups 50 --days 365
+
+    VANTAGE_API_URL=http://127.0.0.1:8765/vantage/v1
+    LTM1_PROD=http://127.0.0.1:8765/timegpt/forecast
+    INSAMPLE_LTM_URL_PROD=http://127.0.0.1:8765/timegpt/insample
+    LTM_MULTI_SERIES_URL_PROD=http://127.0.0.1:8765/timegpt/multi_series
+    INSAMPLE_LTM_MULTI_SERIES_URL_PROD=http://127.0.0.1:8765/timegpt/multi_series_insample
+
+The chat completion API is served under ``/openai/v1`` (use it as ``openai.api_base``).
+"""
+# Import required libraries
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_costs
+
+# Default latency of each API, in seconds.
+DEFAULT_LATENCY = {'vantage': 0.0, 'timegpt': 0.0, 'openai': 0.0}
+
+# Cost rows per page of the stub Vantage API.
+PAGE_SIZE = 1000
+
+
+################################################
+#  Fake model answers
+################################################
+
+def _naive_interval(y, level):
+    """Return the one-sided width of a normal prediction interval from the day-to-day changes of y."""
+    z = {80: 1.2816, 90: 1.6449, 95: 1.96, 99: 2.5758}.get(int(level), 1.6449)
+    return z * (np.std(np.diff(y)) if len(y) > 1 else 0.0)
+
+
+def forecast_series(dates, y, fh, levels, insample=False):
+    """Forecast one series with a weekly seasonal naive model.
+
+    Returns the columns of a TimeGPT answer: ``timestamp``, ``value`` and
+    ``lo-<level>`` / ``hi-<level>`` for every requested level.
+    """
+    y = np.asarray(y, dtype=float)
+    if insample:
+        # Predict each day with the value of the same weekday a week before
+        timestamps = list(dates)
+        value = np.concatenate([y[:7], y[:-7]])[:len(y)]
+    else:
+        last = pd.Timestamp(dates[-1])
+        timestamps = pd.date_range(last + pd.Timedelta(days=1), periods=fh, freq='D').strftime('%Y-%m-%d').tolist()
+        season = y[-7:] if len(y) >= 7 else y
+        value = np.resize(season, fh)
+    columns = {'timestamp': timestamps, 'value': value.tolist()}
+    for level in levels:
+        width = _naive_interval(y, level)
+        columns[f'lo-{level}'] = (value - width).tolist()
+        columns[f'hi-{level}'] = (value + width).tolist()
+    return columns
+
+
+def timegpt_answer(body, insample):
+    """Answer a single-series TimeGPT request."""
+    dates = sorted(body['y'])
+    y = [body['y'][date] for date in dates]
+    return {'data': forecast_series(dates, y, body.get('fh', 30), body.get('level', [90]), insample)}
+
+
+def timegpt_multi_series_answer(body, insample):
+    """Answer a multi-series TimeGPT request, in the split-orient long format."""
+    frame = pd.DataFrame(body['y']['data'], columns=body['y']['columns'])
+    levels = body.get('level', [90])
+    columns = ['unique_id', 'ds', 'TimeGPT', *(f'TimeGPT-{side}-{level}' for level in levels for side in ('lo', 'hi'))]
+    rows = []
+    for uid, group in frame.groupby('unique_id', sort=False):
+        group = group.sort_values('ds')
+        series = forecast_series(group['ds'].tolist(), group['y'].to_numpy(), body.get('fh', 30), levels, insample)
+        fields = [series['timestamp'], series['value'], *(series[f'{side}-{level}'] for level in levels for side in ('lo', 'hi'))]
+        rows.extend([uid, *values] for values in zip(*fields))
+    return {'data': {'forecast': {'columns': columns, 'data': rows}}}
+
+
+def chat_answer(body):
+    """Answer a chat completion request; batched prompts get a JSON object per service."""
+    prompt = body['messages'][-1]['content']
+    try:
+        services = [item['service'] for item in json.loads(prompt)]
+        content = json.dumps({service: f'Synthetic explanation for {service}.' for service in services})
+    except (ValueError, TypeError, KeyError):
+        content = 'You saw unusual usage on the following dates. Synthetic explanation.'
+    return {
+        'id': 'chatcmpl-stub',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+    }
+
+
+################################################
+#  Server
+################################################
+
+class StubServer:
+    """Serve the stub APIs from a background thread.
+
+    ``reports`` maps report ids to costs payloads (see ``synthetic.generate_costs``).
+    ``latency`` maps ``'vantage'``, ``'timegpt'`` and ``'openai'`` to the
+    seconds each of their requests waits before being answered. ``requests``
+    counts the requests served per API.
+    """
+
+    def __init__(self, reports=None, latency=None, host='127.0.0.1', port=0, page_size=PAGE_SIZE):
+        self.reports = dict(reports or {})
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.page_size = page_size
+        self.requests = {api: 0 for api in DEFAULT_LATENCY}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def urls(self):
+        """Return the endpoint of every stub API, keyed by the environment variable that configures it."""
+        return {
+            'VANTAGE_API_URL': f'{self.url}/vantage/v1',
+            'LTM1_PROD': f'{self.url}/timegpt/forecast',
+            'INSAMPLE_LTM_URL_PROD': f'{self.url}/timegpt/insample',
+            'LTM_MULTI_SERIES_URL_PROD': f'{self.url}/timegpt/multi_series',
+            'INSAMPLE_LTM_MULTI_SERIES_URL_PROD': f'{self.url}/timegpt/multi_series_insample',
+            'OPENAI_API_BASE': f'{self.url}/openai/v1',
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve from the calling thread until interrupted."""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, api):
+        with self._lock:
+            self.requests[api] += 1
+        time.sleep(self.latency[api])
+
+    # Vantage API
+    def vantage(self, path, query):
+        if path == '/vantage/v1/reports':
+            reports = [{'id': report_id, 'title': f'Synthetic report {report_id}', 'workspace': 'Synthetic workspace'} for report_id in self.reports]
+            return 200, {'reports': reports, 'links': {}}
+        match = re.fullmatch(r'/vantage/v1/reports/([^/]+)/costs', path)
+        if match is None or match.group(1) not in self.reports:
+            return 404, {'errors': ['Not found']}
+
+        costs = self.reports[match.group(1)]['costs']
+        start, end = query.get('start_date'), query.get('end_date')
+        costs = [row for row in costs if (start is None or row['accrued_at'] >= start) and (end is None or row['accrued_at'] <= end)]
+        grouping = query.get('grouping')
+        if grouping:
+            keys = ['accrued_at', 'amount', *grouping.split(',')]
+            costs = [{key: row[key] for key in keys if key in row} for row in costs]
+
+        # Paginate like the real API, with next and last links
+        last = max(1, -(-len(costs) // self.page_size))
+        page = int(query.get('page', 1))
+        link = lambda number: f'{self.url}{path}?{urlencode({**query, "page": number})}'
+        links = {'last': link(last), 'next': link(page + 1) if page < last else None}
+        return 200, {'costs': costs[(page - 1) * self.page_size:page * self.page_size], 'links': links}
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if not url.path.startswith('/vantage/'):
+                return self._send(404, {'errors': ['Not found']})
+            stub.count('vantage')
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self._send(*stub.vantage(url.path, query))
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if path.startswith('/timegpt/'):
+                stub.count('timegpt')
+                endpoint = path[len('/timegpt/'):]
+                insample = endpoint.endswith('insample')
+                if endpoint in ('forecast', 'insample'):
+                    return self._send(200, timegpt_answer(body, insample))
+                if endpoint in ('multi_series', 'multi_series_insample'):
+                    return self._send(200, timegpt_multi_series_answer(body, insample))
+            elif path == '/openai/v1/chat/completions':
+                stub.count('openai')
+                return self._send(200, chat_answer(body))
+            self._send(404, {'errors': ['Not found']})
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve stub Vantage, TimeGPT and chat completion APIs.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--report-id', default='synthetic', help='id of the synthetic report')
+    parser.add_argument('--groups', type=int, default=20, help='number of synthetic groups')
+    parser.add_argument('--days', type=int, default=365, help='days of synthetic cost history')
+    parser.add_argument('--vantage-latency', type=float, default=0.05, help='seconds per Vantage request')
+    parser.add_argument('--timegpt-latency', type=float, default=0.5, help='seconds per TimeGPT request')
+    parser.add_argument('--openai-latency', type=float, default=1.0, help='seconds per chat completion request')
+    args = parser.parse_args(argv)
+
+    reports = {args.report_id: generate_costs(args.groups, args.days)}
+    latency = {'vantage': args.vantage_latency, 'timegpt': args.timegpt_latency, 'openai': args.openai_latency}
+    stub = StubServer(reports, latency, port=args.port)
+    for name, url in stub.urls().items():
+        print(f'{name}={url}')
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Synthetic Vantage cost payloads with trends, weekly seasonality and injected spikes."""
+# Import required libraries
+import numpy as np
+import pandas as pd
+
+PROVIDERS = ('aws', 'gcp', 'azure', 'datadog', 'snowflake')
+
+
+def group_keys(n_groups):
+    """Return the provider, service and account of every synthetic group."""
+    return [
+        {'provider': PROVIDERS[i % len(PROVIDERS)], 'service': f'service-{i:04d}', 'account_id': f'acct-{i % 16:02d}'}
+        for i in range(n_groups)
+    ]
+
+
+def cost_matrix(n_groups, n_days, seed=0, spike_rate=0.01):
+    """Return a days x groups array of daily costs.
+
+    Every group has its own level, linear trend and weekly profile plus
+    multiplicative noise; a fraction ``spike_rate`` of the points are
+    multiplied (spikes) or divided (drops) by a random factor between 2 and 5.
+    """
+    rng = np.random.default_rng(seed)
+    days = np.arange(n_days)[:, None]
+    level = rng.lognormal(mean=3.0, sigma=1.0, size=n_groups)
+    trend = rng.normal(0.0, 0.002, size=n_groups)
+    weekly = 1.0 + rng.uniform(0.0, 0.3, size=n_groups) * np.sin(2 * np.pi * days / 7 + rng.uniform(0, 2 * np.pi, size=n_groups))
+    noise = rng.lognormal(mean=0.0, sigma=0.05, size=(n_days, n_groups))
+    costs = level * (1.0 + trend * days) * weekly * noise
+
+    # Inject spikes and drops
+    anomalous = rng.random((n_days, n_groups)) < spike_rate
+    factor = rng.uniform(2.0, 5.0, size=(n_days, n_groups))
+    factor = np.where(rng.random((n_days, n_groups)) < 0.5, factor, 1.0 / factor)
+    return np.clip(np.where(anomalous, costs * factor, costs), 0.0, None)
+
+
+def generate_costs(n_groups, n_days, start='2023-03-01', seed=0, spike_rate=0.01):
+    """Return a costs payload in the shape of ``pipeline.fetch_costs``: ``{"costs": [...]}``.
+
+    Every row carries the ``provider``, ``service`` and ``account_id`` of its
+    group, so the payload can be transformed with any of those groupings.
+    """
+    costs = cost_matrix(n_groups, n_days, seed=seed, spike_rate=spike_rate)
+    dates = pd.date_range(start, periods=n_days, freq='D').strftime('%Y-%m-%d').tolist()
+    keys = group_keys(n_groups)
+    return {
+        'costs': [
+            {'accrued_at': date, 'amount': f'{costs[day, group]:.6f}', **keys[group]}
+            for day, date in enumerate(dates)
+            for group in range(n_groups)
+        ]
+    }
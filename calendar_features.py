@@ -0,0 +1,94 @@
+"""Vectorized calendar features used as TimeGPT exogenous variables."""
+# Import required libraries
+import functools
+
+import numpy as np
+import pandas as pd
+
+# Every feature the engine can compute, in the order they are sent to TimeGPT.
+FEATURES = ('month_start', 'month_end', 'quarter_end', 'weekend', 'holiday')
+
+# Local holiday table (US federal holidays).
+# Fixed-date holidays as (month, day).
+FIXED_HOLIDAYS = {
+    (1, 1): "New Year's Day",
+    (6, 19): 'Juneteenth',
+    (7, 4): 'Independence Day',
+    (11, 11): 'Veterans Day',
+    (12, 25): 'Christmas Day',
+}
+# Floating holidays as (month, weekday, nth occurrence); -1 is the last occurrence of the month.
+FLOATING_HOLIDAYS = {
+    (1, 0, 3): 'Martin Luther King Jr. Day',
+    (2, 0, 3): "Presidents' Day",
+    (5, 0, -1): 'Memorial Day',
+    (9, 0, 1): 'Labor Day',
+    (10, 0, 2): 'Columbus Day',
+    (11, 3, 4): 'Thanksgiving Day',
+}
+
+
+def _holiday_flags(dates):
+    """Flag the dates that fall on a holiday of the local table."""
+    month, day, weekday = dates.month.to_numpy(), dates.day.to_numpy(), dates.weekday.to_numpy()
+    flags = np.zeros(len(dates), dtype=bool)
+    for fixed_month, fixed_day in FIXED_HOLIDAYS:
+        flags |= (month == fixed_month) & (day == fixed_day)
+    nth = (day - 1) // 7 + 1
+    is_last = day + 7 > dates.days_in_month.to_numpy()
+    for rule_month, rule_weekday, rule_nth in FLOATING_HOLIDAYS:
+        occurrence = is_last if rule_nth == -1 else nth == rule_nth
+        flags |= (month == rule_month) & (weekday == rule_weekday) & occurrence
+    return flags
+
+
+_FEATURE_FUNCTIONS = {
+    'month_start': lambda dates: dates.is_month_start,
+    'month_end': lambda dates: dates.is_month_end,
+    'quarter_end': lambda dates: dates.is_quarter_end,
+    'weekend': lambda dates: dates.weekday >= 5,
+    'holiday': _holiday_flags,
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _calendar_matrix(start, length, features):
+    # Memoized on (start, length, features); the returned array is shared, so it is made read-only.
+    dates = pd.date_range(start=start, periods=length, freq='D')
+    columns = [np.asarray(_FEATURE_FUNCTIONS[name](dates), dtype=np.int8) for name in features]
+    matrix = np.column_stack(columns) if columns else np.empty((length, 0), dtype=np.int8)
+    matrix.setflags(write=False)
+    return matrix
+
+
+def _normalize(start, features):
+    features = tuple(features)
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise ValueError(f'Unknown calendar features: {sorted(unknown)}. Available features are {FEATURES}.')
+    return pd.Timestamp(start).strftime('%Y-%m-%d'), features
+
+
+def calendar_features(start, length, features=FEATURES):
+    """Return a date-indexed frame with one 0/1 column per requested feature."""
+    start, features = _normalize(start, features)
+    return pd.DataFrame(
+        _calendar_matrix(start, length, features),
+        index=pd.date_range(start=start, periods=length, freq='D'),
+        columns=list(features),
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _exogenous_payload(start, length, features):
+    dates = pd.date_range(start=start, periods=length, freq='D').strftime('%Y-%m-%d')
+    return dict(zip(dates, _calendar_matrix(start, length, features).tolist()))
+
+
+def exogenous_payload(start, length, features=FEATURES):
+    """Return the features in the single-series TimeGPT ``x`` format: ``{date: [feature values]}``.
+
+    The dict is memoized and shared between calls, so it must not be modified.
+    """
+    start, features = _normalize(start, features)
+    return _exogenous_payload(start, length, features)
@@ -0,0 +1,202 @@
+"""Persistent, incremental store of Vantage cost history."""
+# Import required libraries
+import datetime
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+import instrumentation
+from sqlite_store import connect, open_store
+
+# Default location of the store, shared by every app worker on the host.
+DEFAULT_STORE_PATH = os.environ.get(
+    'VANTAGE_COST_STORE', os.path.join(os.path.expanduser('~'), '.cache', 'vantage', 'costs.sqlite')
+)
+
+# Number of already stored days that are fetched again on every refresh, to pick up restated costs.
+DEFAULT_OVERLAP_DAYS = 3
+
+# Seconds after a refresh during which the stored history is served without asking Vantage again.
+DEFAULT_REFRESH_INTERVAL = 900
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS costs (
+    tenant TEXT NOT NULL,
+    report_id TEXT NOT NULL,
+    grouping TEXT NOT NULL,
+    accrued_at TEXT NOT NULL,
+    amount REAL NOT NULL,
+    keys TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS costs_by_tenant_report ON costs (tenant, report_id, grouping, accrued_at);
+CREATE TABLE IF NOT EXISTS sync_state (
+    tenant TEXT NOT NULL,
+    report_id TEXT NOT NULL,
+    grouping TEXT NOT NULL,
+    covered_from TEXT NOT NULL,
+    last_accrued_at TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (tenant, report_id, grouping)
+);
+'''
+
+
+class CostStore:
+    """SQLite store of cost rows keyed by tenant, report ID and grouping.
+
+    The tenant is derived from the Vantage token (see ``tenant_key``), so a
+    history fetched with one token is never served to callers holding
+    another, even though every worker on the host shares the store.
+    Each (tenant, report, grouping) remembers the first day it covers and the
+    last ``accrued_at`` it has seen, so a refresh only asks Vantage for the
+    days after that point plus ``overlap_days`` to catch restated costs.
+    A history refreshed less than ``refresh_interval`` seconds ago is served
+    as is, so callers sharing a report do not each hit the API.
+
+    Rows are stored as typed columns: the day, the amount and the JSON of
+    their grouping keys, which only repeats a handful of distinct values.
+    Histories are loaded straight into the frame of ``pipeline.costs_frame``.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, overlap_days=DEFAULT_OVERLAP_DAYS, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.path = path
+        self.overlap_days = overlap_days
+        self.refresh_interval = refresh_interval
+        if os.path.exists(path):
+            _drop_outdated_tables(path)
+        open_store(path, _SCHEMA)
+
+    def state(self, tenant, report_id, grouping):
+        """Return ``(covered_from, last_accrued_at)`` for a report, or None if it was never fetched."""
+        with connect(self.path) as conn:
+            return conn.execute(
+                'SELECT covered_from, last_accrued_at FROM sync_state WHERE tenant = ? AND report_id = ? AND grouping = ?',
+                (tenant, str(report_id), grouping),
+            ).fetchone()
+
+    def is_fresh(self, tenant, report_id, grouping, start_date):
+        """Return True if the stored history covers ``start_date`` and was refreshed within ``refresh_interval``."""
+        with connect(self.path) as conn:
+            row = conn.execute(
+                'SELECT covered_from, updated_at FROM sync_state WHERE tenant = ? AND report_id = ? AND grouping = ?',
+                (tenant, str(report_id), grouping),
+            ).fetchone()
+        if row is None or start_date < row[0]:
+            return False
+        age = datetime.datetime.now(datetime.timezone.utc) - datetime.datetime.fromisoformat(row[1])
+        return age.total_seconds() < self.refresh_interval
+
+    def delta_start(self, tenant, report_id, grouping, start_date):
+        """Return the first day that has to be requested from Vantage to bring the store up to date."""
+        state = self.state(tenant, report_id, grouping)
+        if state is None or start_date < state[0] or state[1] is None:
+            # Nothing stored yet, or the user asked for an earlier history: fetch everything.
+            return start_date
+        last_seen = datetime.date.fromisoformat(state[1])
+        return max(start_date, (last_seen - datetime.timedelta(days=self.overlap_days)).isoformat())
+
+    def merge(self, tenant, report_id, grouping, since, costs, start_date=None):
+        """Replace the stored rows from ``since`` onwards with freshly fetched ``costs`` and return how many were merged.
+
+        ``costs`` can be any iterable, e.g. the pages streamed by the Vantage
+        client; it is consumed row by row without being held in memory.
+        """
+        report_id = str(report_id)
+        rows = ((tenant, report_id, grouping, cost['accrued_at'][:10], float(cost['amount']), _keys(cost)) for cost in costs)
+        with connect(self.path) as conn:
+            # Stream the rows into a temporary table of this connection, so the store is only locked for the swap
+            conn.execute('CREATE TEMP TABLE fetched (tenant TEXT, report_id TEXT, grouping TEXT, accrued_at TEXT, amount REAL, keys TEXT)')
+            conn.executemany('INSERT INTO temp.fetched VALUES (?, ?, ?, ?, ?, ?)', rows)
+            fetched = conn.execute('SELECT COUNT(*) FROM temp.fetched').fetchone()[0]
+            conn.execute(
+                'DELETE FROM costs WHERE tenant = ? AND report_id = ? AND grouping = ? AND accrued_at >= ?',
+                (tenant, report_id, grouping, since),
+            )
+            conn.execute('INSERT INTO costs SELECT * FROM temp.fetched')
+            last_accrued_at = conn.execute(
+                'SELECT MAX(accrued_at) FROM costs WHERE tenant = ? AND report_id = ? AND grouping = ?', (tenant, report_id, grouping)
+            ).fetchone()[0]
+            previous = conn.execute(
+                'SELECT covered_from FROM sync_state WHERE tenant = ? AND report_id = ? AND grouping = ?', (tenant, report_id, grouping)
+            ).fetchone()
+            covered_from = min(start_date or since, previous[0]) if previous else (start_date or since)
+            conn.execute(
+                'INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?, ?)',
+                (tenant, report_id, grouping, covered_from, last_accrued_at, datetime.datetime.now(datetime.timezone.utc).isoformat()),
+            )
+        return fetched
+
+    def load(self, tenant, report_id, grouping, start_date=None):
+        """Return the stored costs as a frame of days, float amounts and categorical keys, sorted by day."""
+        with connect(self.path) as conn:
+            rows = pd.read_sql_query(
+                'SELECT accrued_at, amount, keys FROM costs WHERE tenant = ? AND report_id = ? AND grouping = ? AND accrued_at >= ? ORDER BY accrued_at',
+                conn, params=(tenant, str(report_id), grouping, start_date or ''),
+            )
+        # Decode the keys once per distinct combination, and give every key a categorical column
+        codes, combinations = pd.factorize(rows['keys'])
+        keys = pd.DataFrame([json.loads(combination) for combination in combinations])
+        costs = pd.DataFrame({
+            'accrued_at': pd.to_datetime(rows['accrued_at'], format='%Y-%m-%d'),
+            'amount': rows['amount'].astype(float),
+        })
+        for key in keys.columns:
+            column = pd.Categorical(keys[key])
+            costs[key] = pd.Categorical.from_codes(column.codes[codes], column.categories)
+        return costs
+
+    def refresh(self, client, tenant, report_id, grouping, start_date):
+        """Fetch only the missing days of a tenant's report through ``client``, merge them and return the full history."""
+        with instrumentation.span('cost_store.refresh', report_id=str(report_id), grouping=grouping) as span:
+            if self.is_fresh(tenant, report_id, grouping, start_date):
+                span.set(fresh=True)
+                return self.load(tenant, report_id, grouping, start_date)
+            since = self.delta_start(tenant, report_id, grouping, start_date)
+            costs = client.iter_costs(report_id, grouping=grouping, start_date=since)
+            fetched = self.merge(tenant, report_id, grouping, since, costs, start_date=start_date)
+            history = self.load(tenant, report_id, grouping, start_date)
+            span.set(since=since, fetched_rows=fetched, rows=len(history))
+            return history
+
+
+def tenant_key(token):
+    """Return the key under which the costs fetched with a Vantage token are stored; the token itself is never stored."""
+    return hashlib.sha256(f'vantage-tenant:{token}'.encode()).hexdigest()
+
+
+def encode_costs(costs):
+    """Return a costs frame as JSON-like columns, keys as codes into their categories, e.g. to share it through Redis."""
+    keys = [c for c in costs.columns if c not in ('accrued_at', 'amount')]
+    return {
+        'accrued_at': costs['accrued_at'].dt.strftime('%Y-%m-%d').tolist(),
+        'amount': costs['amount'].tolist(),
+        'keys': {key: {'categories': costs[key].cat.categories.tolist(), 'codes': costs[key].cat.codes.tolist()} for key in keys},
+    }
+
+
+def decode_costs(columns):
+    """Rebuild the costs frame of ``encode_costs``."""
+    costs = pd.DataFrame({
+        'accrued_at': pd.to_datetime(pd.Series(columns['accrued_at'], dtype=object), format='%Y-%m-%d'),
+        'amount': pd.Series(columns['amount'], dtype=float),
+    })
+    for key, column in columns['keys'].items():
+        costs[key] = pd.Categorical.from_codes(column['codes'], column['categories'])
+    return costs
+
+
+def _keys(cost):
+    # The grouping keys of a cost row, as the JSON stored in the keys column; equal combinations give equal strings
+    return json.dumps({key: value for key, value in cost.items() if key not in ('accrued_at', 'amount')}, sort_keys=True)
+
+
+def _drop_outdated_tables(path):
+    # Rows stored before the store was keyed by tenant cannot be attributed to one, and rows stored as JSON
+    # payloads lack the typed columns: drop them so they are fetched again
+    with connect(path) as conn:
+        sync_state = {row[1] for row in conn.execute('PRAGMA table_info(sync_state)')}
+        costs = {row[1] for row in conn.execute('PRAGMA table_info(costs)')}
+        if (sync_state and 'tenant' not in sync_state) or (costs and 'amount' not in costs):
+            conn.executescript('DROP TABLE IF EXISTS costs; DROP TABLE IF EXISTS sync_state;')
@@ -0,0 +1,208 @@
+"""Cached, batched and concurrent GPT-4 explanations of anomalies."""
+# Import required libraries
+import asyncio
+import datetime
+import hashlib
+import inspect
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import openai
+
+import instrumentation
+from sqlite_store import SQLiteCache
+
+logger = logging.getLogger(__name__)
+
+# Set OpenAI API key from environment variable
+openai.api_key = os.environ.get('OPENAI_TOKEN')
+
+# Default location of the persistent explanation cache.
+DEFAULT_EXPLANATION_CACHE_PATH = os.environ.get(
+    'VANTAGE_EXPLANATION_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'vantage', 'explanations.sqlite')
+)
+
+MODEL = "gpt-4"
+
+SYSTEM_PROMPT = "You are an expert in anomaly detection for time series. In particular you help people understand pontential explanations for anomalies in usage of cloud services. The user gives you dates on which they saw spikes or drops and you analyze the dates and explain what could be special about those dates. For example, if they are holidays or close to holidays, quarted ends, month ends, weekends, etc. You always answer in a short parragprah and are concise. You always begin by saying: You saw unusual [service] usage on the following dates: and then you list the dates, saying whether each one was a spike or a drop. You then explain what could be special about those dates related to that specifc service."
+
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + " The user may ask about several services at once, as a JSON list of objects with the keys service, spikes and drops. In that case you write one paragraph per service and answer only with a JSON object that maps each service name to its paragraph, without Markdown code fences."
+
+
+def format_custom_date(dates_list):
+    """Format a list of dates into a more readable format."""
+    formatted_dates = []
+    for date_str in dates_list:
+        date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d")
+        day_of_week = date_obj.strftime("%A")
+        day = date_obj.strftime("%d")
+        day_suffix = "th" if 11 <= int(day) <= 13 else {1: "st", 2: "nd", 3: "rd"}.get(int(day) % 10, "th")
+        month = date_obj.strftime("%B")
+        year = date_obj.strftime("%Y")
+        formatted_date = f"{day_of_week} {day}{day_suffix} of {month} {year}"
+        formatted_dates.append(formatted_date)
+    return formatted_dates
+
+
+def anomaly_dates(anomalies):
+    """Return the sorted, de-duplicated spike and drop dates of an anomaly table."""
+    dates = {}
+    for direction in ('spike', 'drop'):
+        selected = anomalies.loc[anomalies['direction'] == direction, 'date']
+        dates[direction] = sorted(set(selected.dt.strftime('%Y-%m-%d')))
+    return dates['spike'], dates['drop']
+
+
+def explanation_key(service, spikes, drops):
+    """Return the cache key of an explanation: the model, the service and its normalized anomaly dates."""
+    canonical = json.dumps([MODEL, service, spikes, drops], separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def parse_batch_answer(answer):
+    """Parse the JSON object of a batched answer, ignoring the Markdown code fence it is often wrapped in."""
+    fenced = re.search(r'```(?:json)?\s*(.*?)\s*```', answer, re.DOTALL)
+    return json.loads(fenced.group(1) if fenced else answer)
+
+
+def single_prompt(service, spikes, drops):
+    """Build the chat messages that explain the anomalies of one service."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Here is the list of dates where I detected spikes in usage in {service}:  {format_custom_date(spikes)}. Here is the list of dates where I detected drops in usage in {service}:  {format_custom_date(drops)}"},
+    ]
+
+
+def batch_prompt(items):
+    """Build the chat messages that explain many ``(service, spikes, drops)`` items in a single request."""
+    request = [
+        {"service": service, "spikes": format_custom_date(spikes), "drops": format_custom_date(drops)}
+        for service, spikes, drops in items
+    ]
+    return [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": json.dumps(request)},
+    ]
+
+
+async def openai_complete(messages):
+    """Default completion backend: GPT-4 through the OpenAI chat completion API."""
+    response = await openai.ChatCompletion.acreate(model=MODEL, messages=messages)
+    return response.choices[0].message.content
+
+
+class RateLimiter:
+    """Space out the start of requests so at most ``requests_per_minute`` start per minute.
+
+    A limiter can be shared by every thread and event loop of the process.
+    """
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    async def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Explainer:
+    """Explain the anomalies of many groups with as few GPT-4 calls as possible.
+
+    Explanations are looked up in a persistent cache keyed by the service and
+    its normalized anomaly dates. The remaining groups are packed
+    ``batch_size`` at a time into one prompt whose JSON answer is split per
+    group, and the prompts are dispatched concurrently (at most
+    ``max_concurrency`` in flight per call, and ``requests_per_minute``
+    started per minute across every call of the explainer).
+
+    ``complete`` is the completion backend, a callable (sync or async) that
+    takes the chat messages and returns the answer text. Pass a fake one to
+    run without OpenAI.
+    """
+
+    def __init__(self, complete=openai_complete, cache=None, batch_size=10, max_concurrency=4, requests_per_minute=60):
+        self.complete = complete
+        self.cache = cache if cache is not None else SQLiteCache(
+            DEFAULT_EXPLANATION_CACHE_PATH, table='explanations', metric='explanation_cache', disk_ttl=30 * 24 * 3600
+        )
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter(requests_per_minute)
+
+    def _items(self, anomalies):
+        # One (service, spikes, drops) item per group of the anomaly table
+        for group, table in anomalies.groupby('group', sort=False):
+            spikes, drops = anomaly_dates(table)
+            yield str(group), spikes, drops
+
+    def cached(self, anomalies):
+        """Return the explanations already in the cache, without any call to the backend."""
+        explanations = {}
+        for service, spikes, drops in self._items(anomalies):
+            explanation = self.cache.get(explanation_key(service, spikes, drops))
+            if explanation is not None:
+                explanations[service] = explanation
+        return explanations
+
+    def explain(self, anomalies):
+        """Return an explanation for every group of the anomaly table, calling the backend only for cache misses."""
+        return asyncio.run(self.aexplain(anomalies))
+
+    async def aexplain(self, anomalies):
+        """Async version of ``explain``."""
+        with instrumentation.span('explain') as span:
+            explanations = self.cached(anomalies)
+            missing = [item for item in self._items(anomalies) if item[0] not in explanations]
+            span.set(groups=len(explanations) + len(missing), missing=len(missing))
+            if not missing:
+                return explanations
+
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            results = await asyncio.gather(*(self._explain_batch(batch, semaphore) for batch in batches))
+            for result in results:
+                explanations.update(result)
+            return explanations
+
+    async def _call(self, messages, semaphore):
+        async with semaphore:
+            await self.limiter.wait()
+            with instrumentation.span('openai.request', prompt_chars=sum(len(m['content']) for m in messages)) as span:
+                if inspect.iscoroutinefunction(self.complete):
+                    answer = await self.complete(messages)
+                else:
+                    answer = await asyncio.to_thread(self.complete, messages)
+                span.set(answer_chars=len(answer))
+                return answer
+
+    async def _explain_batch(self, batch, semaphore):
+        explanations = {}
+        if len(batch) > 1:
+            answer = await self._call(batch_prompt(batch), semaphore)
+            try:
+                parsed = parse_batch_answer(answer)
+            except ValueError:
+                logger.warning('Could not parse the batched explanation answer, explaining one service at a time')
+                instrumentation.count('batch_parse_errors')
+                parsed = {}
+            if isinstance(parsed, dict):
+                explanations = {service: parsed[service] for service, _, _ in batch if isinstance(parsed.get(service), str)}
+
+        # Groups missing from a batched answer (or single-group batches) get their own prompt
+        missing = [item for item in batch if item[0] not in explanations]
+        answers = await asyncio.gather(*(self._call(single_prompt(*item), semaphore) for item in missing))
+        explanations.update({service: answer for (service, _, _), answer in zip(missing, answers)})
+
+        for service, spikes, drops in batch:
+            self.cache.set(explanation_key(service, spikes, drops), explanations[service])
+        return explanations
@@ -0,0 +1,34 @@
+"""Content-addressed, two-tier cache of TimeGPT responses."""
+# Import required libraries
+import hashlib
+import json
+import os
+
+from sqlite_store import SQLiteCache
+
+# Default location of the disk tier.
+DEFAULT_CACHE_PATH = os.environ.get(
+    'VANTAGE_FORECAST_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'vantage', 'forecasts.sqlite')
+)
+
+
+def forecast_key(url, payload):
+    """Return a stable hash of everything that determines a forecast.
+
+    The key covers the endpoint and the full request body: series values,
+    horizon, levels, finetune steps and exogenous features. Dict ordering
+    does not matter; the auth token is not part of the key.
+    """
+    canonical = json.dumps({"url": url, "payload": payload}, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ForecastCache(SQLiteCache):
+    """LRU cache of TimeGPT responses with an in-memory tier backed by a size-bounded SQLite tier.
+
+    See ``SQLiteCache``; lookups are counted as ``forecast_cache_hit_memory``,
+    ``forecast_cache_hit_disk`` and ``forecast_cache_miss``.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, **kwargs):
+        super().__init__(path, table='forecasts', metric='forecast_cache', **kwargs)
@@ -0,0 +1,268 @@
+"""Timed spans and counters for the pipeline stages and outbound HTTP calls.
+
+Code under measurement opens spans around its work::
+
+    with instrumentation.span('timegpt.request', url=url) as span:
+        response = requests.post(url, json=payload)
+        span.set(status=response.status_code, response_bytes=len(response.content))
+
+and bumps counters on the innermost open span with ``count``. Finished spans
+are handed to every registered sink; with no sink registered ``span`` returns
+a shared no-op span and ``count`` returns at once, so instrumentation costs
+next to nothing when it is disabled.
+"""
+# Import required libraries
+import collections
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Registered sinks; instrumentation is enabled while this is not empty.
+_sinks = []
+_sinks_lock = threading.Lock()
+
+# Innermost open span of the current thread or task.
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class _NullSpan:
+    """The span returned while instrumentation is disabled; every method is a no-op."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A timed unit of work with attributes and counters."""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.counts = {}
+        self.parent = None
+        self.error = None
+
+    def __enter__(self):
+        parent = _current.get()
+        self.parent = parent.name if parent is not None else None
+        self._token = _current.set(self)
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        emit(self.record())
+        return False
+
+    def __bool__(self):
+        return True
+
+    def set(self, **attrs):
+        """Add or overwrite attributes of the span."""
+        self.attrs.update(attrs)
+
+    def count(self, name, n=1):
+        """Add ``n`` to a counter of the span."""
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def record(self):
+        return {
+            'name': self.name,
+            'parent': self.parent,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'error': self.error,
+            'attrs': self.attrs,
+            'counts': self.counts,
+        }
+
+
+def enabled():
+    """Return True when at least one sink is registered."""
+    return bool(_sinks)
+
+
+def span(name, **attrs):
+    """Return a context manager timing ``name``; a no-op unless a sink is registered."""
+    if not _sinks:
+        return NULL_SPAN
+    return Span(name, attrs)
+
+
+def count(name, n=1):
+    """Add ``n`` to a counter of the innermost open span, if any."""
+    if not _sinks:
+        return
+    current = _current.get()
+    if current is not None:
+        current.count(name, n)
+
+
+def in_context(fn):
+    """Bind ``fn`` to a copy of the current context, so spans it opens in a worker thread keep their parent."""
+    if not _sinks:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def emit(record):
+    for sink in list(_sinks):
+        sink.write(record)
+
+
+def add_sink(sink):
+    """Register a sink, i.e. an object with a ``write(record)`` method, and return it."""
+    with _sinks_lock:
+        if sink not in _sinks:
+            _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+################################################
+#  Sinks
+################################################
+
+class JsonLinesSink:
+    """Append every span as one JSON line to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+
+class MemorySink:
+    """Keep the most recent spans in memory, e.g. for the app's debug panel."""
+
+    def __init__(self, maxlen=500):
+        self.records = collections.deque(maxlen=maxlen)
+
+    def write(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records.clear()
+
+
+class PrometheusSink:
+    """Aggregate spans into Prometheus counters, rendered in the text exposition format.
+
+    Exposes the number of spans, their total duration and errors per span
+    name, and the total of every span counter and numeric attribute per span
+    name (e.g. bytes sent, series forecast, cache hits, retries), except the
+    ``ignore`` attributes that identify rather than measure.
+    """
+
+    def __init__(self, prefix='vantage', ignore=('status', 'page')):
+        self.prefix = prefix
+        self.ignore = frozenset(ignore)
+        self._lock = threading.Lock()
+        self._spans = collections.defaultdict(lambda: [0, 0.0, 0])
+        self._totals = collections.defaultdict(float)
+
+    def write(self, record):
+        with self._lock:
+            stats = self._spans[record['name']]
+            stats[0] += 1
+            stats[1] += record['duration']
+            stats[2] += record['error'] is not None
+            values = {**record['attrs'], **record['counts']}
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and key not in self.ignore:
+                    self._totals[(record['name'], key)] += value
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        p = self.prefix
+        with self._lock:
+            spans = sorted(self._spans.items())
+            totals = sorted(self._totals.items())
+        # Every metric family is written as one contiguous block
+        lines = []
+        for metric, column, fmt in (('count', 0, '{}'), ('seconds', 1, '{:.6f}'), ('errors', 2, '{}')):
+            lines.append(f'# TYPE {p}_span_{metric} counter')
+            lines.extend(f'{p}_span_{metric}{{span="{name}"}} {fmt.format(stats[column])}' for name, stats in spans)
+        lines.append(f'# TYPE {p}_span_total counter')
+        lines.extend(f'{p}_span_total{{span="{name}",field="{key}"}} {value:g}' for (name, key), value in totals)
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve ``render()`` on ``/metrics`` from a background thread and return the server.
+
+        Only local clients can connect by default; pass ``host='0.0.0.0'`` to expose the metrics publicly.
+        """
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = sink.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+_configured = False
+
+def configure_from_env():
+    """Register the sinks requested by the environment, once per process.
+
+    ``VANTAGE_TRACE_FILE`` appends spans as JSON lines to a file and
+    ``VANTAGE_METRICS_PORT`` serves Prometheus metrics on ``/metrics``, on
+    localhost unless ``VANTAGE_METRICS_HOST`` names another interface.
+    """
+    global _configured
+    with _sinks_lock:
+        if _configured:
+            return
+        _configured = True
+    if os.environ.get('VANTAGE_TRACE_FILE'):
+        add_sink(JsonLinesSink(os.environ['VANTAGE_TRACE_FILE']))
+    if os.environ.get('VANTAGE_METRICS_PORT'):
+        add_sink(PrometheusSink()).serve(int(os.environ['VANTAGE_METRICS_PORT']), os.environ.get('VANTAGE_METRICS_HOST', '127.0.0.1'))
@@ -0,0 +1,162 @@
+"""A local, vectorized forecasting engine for many daily series at once.
+
+It fits every column of a date x group matrix together, with NumPy only,
+and answers in the format of TimeGPT responses (``timestamp``, ``value``,
+``lo-<level>`` and ``hi-<level>``), so its results can stand in for
+TimeGPT's anywhere: quick previews, large batch sweeps, or when the
+endpoint is slow or down.
+
+Two models are available:
+
+- ``seasonal_naive`` repeats the last week;
+- ``ets`` is additive exponential smoothing with a level, a trend and a
+  weekly seasonality. Its smoothing parameters are picked per series, from
+  a small grid fitted for all the series in one pass.
+
+Prediction intervals are conformal-style: their half-width is the empirical
+quantile of the absolute one-step-ahead errors over the last days of the
+history, widened along the horizon like the variance of the model's errors.
+"""
+# Import required libraries
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+# Length of the seasonal cycle of daily costs.
+SEASON = 7
+
+# Days of one-step-ahead errors used to calibrate the prediction intervals.
+CALIBRATION_DAYS = 90
+
+# Grid of smoothing parameters (alpha, beta, gamma) tried for every series by the ets model.
+ETS_GRID = tuple(itertools.product((0.1, 0.3, 0.6), (0.0, 0.02), (0.05, 0.2)))
+
+MODELS = ('ets', 'seasonal_naive')
+
+
+################################################
+#  Models
+################################################
+
+def seasonal_naive(y, fh, season=SEASON):
+    """Fit the seasonal naive model to the rows of ``y`` (series x days).
+
+    Returns the one-step-ahead fitted values (NaN for the first season), the
+    ``fh`` forecasts and the factor by which the interval of each horizon
+    step widens.
+    """
+    n_series, n_days = y.shape
+    fitted = np.full(y.shape, np.nan)
+    fitted[:, season:] = y[:, :-season]
+    steps = np.arange(fh)
+    forecast = y[:, n_days - season + steps % season]
+    widening = np.sqrt(steps // season + 1)
+    return fitted, forecast, np.broadcast_to(widening, (n_series, fh))
+
+
+def exponential_smoothing(y, fh, season=SEASON, grid=ETS_GRID):
+    """Fit additive level + trend + seasonal exponential smoothing to the rows of ``y`` (series x days).
+
+    Every ``(alpha, beta, gamma)`` of ``grid`` is fitted to every series in
+    the same pass over the days, and each series keeps the parameters with
+    the smallest one-step-ahead squared error. Returns the fitted values
+    (NaN for the first season), the ``fh`` forecasts and the widening of the
+    interval of each horizon step.
+    """
+    n_series, n_days = y.shape
+    alpha, beta, gamma = (np.asarray(p, dtype=float)[:, None] for p in zip(*grid))
+
+    # Start from the first season: its mean is the level and its deviations the seasonal indices
+    first = y[:, :season]
+    level = np.broadcast_to(first.mean(axis=1), (len(grid), n_series)).copy()
+    trend = np.zeros_like(level)
+    seasonal = np.broadcast_to(first - first.mean(axis=1, keepdims=True), (len(grid), n_series, season)).copy()
+
+    # Error-correction form of the additive Holt-Winters recursions, for all the grid x series at once
+    fitted = np.full((len(grid), n_series, n_days), np.nan)
+    for t in range(season, n_days):
+        phase = t % season
+        fitted[:, :, t] = level + trend + seasonal[:, :, phase]
+        error = y[:, t] - fitted[:, :, t]
+        level = level + trend + alpha * error
+        trend = trend + alpha * beta * error
+        seasonal[:, :, phase] += gamma * error
+
+    # Keep the best parameters of every series
+    sse = np.nansum((fitted - y) ** 2, axis=2)
+    best = np.argmin(sse, axis=0)
+    series = np.arange(n_series)
+    steps = np.arange(1, fh + 1)
+    phases = (n_days + steps - 1) % season
+    forecast = level[best, series, None] + trend[best, series, None] * steps + seasonal[best, series][:, phases]
+    widening = np.sqrt(1 + (steps - 1) * alpha[best] ** 2)
+    return fitted[best, series], forecast, widening
+
+
+def conformal_width(y, fitted, level, calibration=CALIBRATION_DAYS):
+    """Return, per series, the ``level`` quantile of the absolute one-step errors of its last ``calibration`` days."""
+    errors = np.sort(np.abs(y - fitted)[:, -calibration:], axis=1)
+    n = np.sum(~np.isnan(errors), axis=1)
+    # Finite-sample corrected rank, so the interval covers at least ``level`` percent of new points
+    rank = np.clip(np.ceil((n + 1) * level / 100).astype(int), 1, np.maximum(n, 1)) - 1
+    widths = np.take_along_axis(errors, rank[:, None], axis=1)[:, 0] if errors.shape[1] else np.zeros(len(y))
+    return np.where(n > 0, widths, 0.0)
+
+
+def fit(y, fh=0, model='ets', season=SEASON):
+    """Fit ``model`` to the rows of ``y``; series shorter than two seasons fall back to the naive model."""
+    if model not in MODELS:
+        raise ValueError(f'Unknown model {model!r}, expected one of {MODELS}')
+    if y.shape[1] < 2 * season:
+        # Too short for a seasonal model: repeat the last day
+        return seasonal_naive(y, fh, season=1)
+    if model == 'seasonal_naive':
+        return seasonal_naive(y, fh, season)
+    return exponential_smoothing(y, fh, season)
+
+
+################################################
+#  TimeGPT-like results
+################################################
+
+def _results(groups, timestamps, value, half_widths, levels):
+    # Build one TimeGPT-like ``{'data': {...}}`` result per group
+    timestamps = timestamps.strftime('%Y-%m-%d').tolist()
+    results = {}
+    for i, group in enumerate(groups):
+        data = {'timestamp': timestamps, 'value': value[i].tolist()}
+        for level, width in zip(levels, half_widths):
+            data[f'lo-{level}'] = (value[i] - width[i]).tolist()
+            data[f'hi-{level}'] = (value[i] + width[i]).tolist()
+        results[str(group)] = {'data': data}
+    return results
+
+
+def forecast(frame, fh=30, level=(90,), model='ets', season=SEASON):
+    """Forecast the next ``fh`` days of every column of a date x group matrix.
+
+    Returns a dict mapping each group to a TimeGPT-like forecast response.
+    """
+    with instrumentation.span('local_forecast', model=model, series=frame.shape[1], points=frame.size, fh=fh):
+        y = frame.to_numpy(dtype=float).T
+        fitted, values, widening = fit(y, fh, model, season)
+        widths = [conformal_width(y, fitted, lvl)[:, None] * widening for lvl in level]
+        timestamps = pd.date_range(frame.index[-1] + pd.Timedelta(days=1), periods=fh, freq='D')
+        return _results(frame.columns, timestamps, values, widths, level)
+
+
+def insample(frame, level=(90,), model='ets', season=SEASON):
+    """Predict every day of every column of a date x group matrix from the days before it.
+
+    Returns a dict mapping each group to a TimeGPT-like in-sample response,
+    starting once the model has a season of history to predict from.
+    """
+    with instrumentation.span('local_insample', model=model, series=frame.shape[1], points=frame.size):
+        y = frame.to_numpy(dtype=float).T
+        fitted, _, _ = fit(y, 0, model, season)
+        predicted = ~np.isnan(fitted).any(axis=0)
+        widths = [np.broadcast_to(conformal_width(y, fitted, lvl)[:, None], fitted[:, predicted].shape) for lvl in level]
+        return _results(frame.columns, frame.index[predicted], fitted[:, predicted], widths, level)
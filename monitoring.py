@@ -0,0 +1,177 @@
+"""Incremental anomaly monitoring of many series with an append-only anomaly log."""
+# Import required libraries
+import datetime
+import json
+import os
+
+import pandas as pd
+
+import instrumentation
+from anomalies import detect_anomalies, empty_anomalies
+from cost_store import DEFAULT_OVERLAP_DAYS
+from sqlite_store import connect, open_store
+
+# Default location of the monitor state and anomaly log.
+DEFAULT_MONITOR_PATH = os.environ.get(
+    'VANTAGE_MONITOR_STORE', os.path.join(os.path.expanduser('~'), '.cache', 'vantage', 'monitor.sqlite')
+)
+
+# Days of history sent as context when forecasting the new days of a series.
+DEFAULT_WINDOW = 90
+
+# Days of scored prediction intervals kept per series.
+DEFAULT_KEEP_INTERVALS = 30
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS series_state (
+    report_id TEXT NOT NULL,
+    grouping TEXT NOT NULL,
+    series TEXT NOT NULL,
+    last_scored TEXT NOT NULL,
+    intervals TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (report_id, grouping, series)
+);
+CREATE TABLE IF NOT EXISTS anomaly_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    report_id TEXT NOT NULL,
+    grouping TEXT NOT NULL,
+    series TEXT NOT NULL,
+    date TEXT NOT NULL,
+    y REAL NOT NULL,
+    value REAL,
+    lo REAL,
+    hi REAL,
+    direction TEXT NOT NULL,
+    severity REAL NOT NULL,
+    logged_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS anomaly_log_by_report ON anomaly_log (report_id, grouping, date);
+'''
+
+
+class AnomalyMonitor:
+    """Score only the days that arrived since the previous run of every series.
+
+    Each (report, grouping, series) remembers the last date it scored and the
+    prediction intervals of its last ``keep_intervals`` scored days. The last
+    ``overlap_days`` of the history are still accruing or being restated (the
+    cost store fetches them again on every refresh), so they are only scored
+    once they are older than that. A series
+    seen for the first time is scored once on its whole history with
+    ``insample``; afterwards only its new days are forecast by ``forecast``,
+    from the ``window`` days that precede them, and scored against their
+    intervals. Anomalies are appended to a log that is never rewritten, so
+    costs restated after that are not scored again.
+
+    ``forecast(frame, fh)`` and ``insample(frame)`` take a date x group
+    matrix and return per-group TimeGPT results, like ``forecast_all_groups``.
+    Series missing from their results are retried on the next run.
+    """
+
+    def __init__(self, path=DEFAULT_MONITOR_PATH, window=DEFAULT_WINDOW, keep_intervals=DEFAULT_KEEP_INTERVALS, level=90,
+                 overlap_days=DEFAULT_OVERLAP_DAYS):
+        self.path = path
+        self.window = window
+        self.keep_intervals = keep_intervals
+        self.level = level
+        self.overlap_days = overlap_days
+        open_store(path, _SCHEMA)
+
+    def last_scored(self, report_id, grouping):
+        """Return the last scored date of every monitored series of a report."""
+        with connect(self.path) as conn:
+            rows = conn.execute(
+                'SELECT series, last_scored FROM series_state WHERE report_id = ? AND grouping = ?',
+                (str(report_id), grouping),
+            ).fetchall()
+        return dict(rows)
+
+    def intervals(self, report_id, grouping, series):
+        """Return the recent prediction intervals of a series, in the TimeGPT ``data`` format."""
+        with connect(self.path) as conn:
+            row = conn.execute(
+                'SELECT intervals FROM series_state WHERE report_id = ? AND grouping = ? AND series = ?',
+                (str(report_id), grouping, series),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def log(self, report_id, grouping, since=None):
+        """Return the logged anomalies of a report, optionally only those dated ``since`` or later."""
+        with connect(self.path) as conn:
+            table = pd.read_sql_query(
+                'SELECT series AS "group", date, y, value, lo, hi, direction, severity, logged_at FROM anomaly_log '
+                'WHERE report_id = ? AND grouping = ? AND date >= ? ORDER BY id',
+                conn, params=(str(report_id), grouping, since or ''),
+            )
+        table['date'] = pd.to_datetime(table['date'])
+        return table
+
+    def update(self, report_id, grouping, matrix, forecast, insample):
+        """Score the new, settled days of every column of ``matrix``, log their anomalies and return them."""
+        with instrumentation.span('monitor.update', report_id=str(report_id), grouping=grouping, series=matrix.shape[1]) as span:
+            # Hold back the days that may still change
+            matrix = matrix.iloc[:max(len(matrix) - self.overlap_days, 0)]
+            if matrix.empty:
+                return empty_anomalies()
+            last_scored = self.last_scored(report_id, grouping)
+            scored = []
+
+            # Series seen for the first time are scored once on their whole history
+            fresh = [series for series in matrix.columns if series not in last_scored]
+            if fresh:
+                actuals = matrix[fresh]
+                scored.append((actuals, insample(actuals)))
+
+            # The others only forecast their new days, batched by the date they were last scored
+            pending = {}
+            for series in matrix.columns:
+                if series in last_scored:
+                    pending.setdefault(last_scored[series], []).append(series)
+            for last, series in pending.items():
+                new = matrix.loc[matrix.index > last, series]
+                if new.empty:
+                    continue
+                context = matrix.loc[matrix.index <= last, series].iloc[-self.window:]
+                scored.append((new, forecast(context, len(new))))
+
+            anomalies = [self._record(report_id, grouping, actuals, results) for actuals, results in scored]
+            anomalies = [table for table in anomalies if len(table)]
+            anomalies = pd.concat(anomalies, ignore_index=True) if anomalies else empty_anomalies()
+            span.set(scored_points=sum(actuals.size for actuals, _ in scored), anomalies=len(anomalies))
+            return anomalies
+
+    def _record(self, report_id, grouping, actuals, results):
+        # Score the points, append their anomalies to the log and move the state of the scored series forward
+        results = {series: result for series, result in results.items() if series in actuals.columns}
+        anomalies = detect_anomalies(actuals, results, self.level)
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        last = actuals.index[-1].strftime('%Y-%m-%d')
+        report_id = str(report_id)
+        with connect(self.path) as conn:
+            conn.executemany(
+                'INSERT INTO anomaly_log (report_id, grouping, series, date, y, value, lo, hi, direction, severity, logged_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (report_id, grouping, row.group, row.date.strftime('%Y-%m-%d'), row.y, row.value, row.lo, row.hi,
+                     row.direction, row.severity, now)
+                    for row in anomalies.itertuples(index=False)
+                ],
+            )
+            for series, result in results.items():
+                previous = conn.execute(
+                    'SELECT intervals FROM series_state WHERE report_id = ? AND grouping = ? AND series = ?',
+                    (report_id, grouping, series),
+                ).fetchone()
+                intervals = _recent_intervals(json.loads(previous[0]) if previous else {}, result['data'], self.keep_intervals)
+                conn.execute(
+                    'INSERT OR REPLACE INTO series_state VALUES (?, ?, ?, ?, ?, ?)',
+                    (report_id, grouping, series, last, json.dumps(intervals), now),
+                )
+        return anomalies
+
+
+def _recent_intervals(previous, data, keep):
+    """Append the intervals of newly scored days to the previous ones and keep the last ``keep`` days."""
+    merged = {key: list(previous.get(key, [])) + list(values) for key, values in data.items()}
+    return {key: values[-keep:] for key, values in merged.items()}
@@ -0,0 +1,549 @@
+"""Headless fetch -> transform -> forecast -> in-sample -> anomaly -> explain pipeline.
+
+The Streamlit app in ``vantage.py`` is a view on top of this module. It can
+also be run from the command line to process many reports at once, e.g. for
+nightly jobs::
+
+    python pipeline.py 3637:account_id 3637:provider+service 4120:total --workers 4 --output-dir out --format parquet
+"""
+# Import required libraries
+import argparse
+import functools
+import json
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+import instrumentation
+import local_forecast
+from anomalies import detect_anomalies
+from calendar_features import FEATURES, calendar_features, exogenous_payload
+from cost_store import CostStore, decode_costs, encode_costs, tenant_key
+from explanations import Explainer
+from forecast_cache import ForecastCache, forecast_key
+from monitoring import AnomalyMonitor
+from single_flight import SingleFlight, backend_from_env, flight_key
+from stages import StageGraph, fingerprint
+from vantage_client import VantageClient
+
+logger = logging.getLogger(__name__)
+
+# Register the span sinks requested by the environment (VANTAGE_TRACE_FILE, VANTAGE_METRICS_PORT).
+instrumentation.configure_from_env()
+
+# TimeGPT endpoints
+FORECAST_URL = os.environ.get('LTM1_PROD')
+INSAMPLE_URL = os.environ.get('INSAMPLE_LTM_URL_PROD')
+MULTI_SERIES_FORECAST_URL = os.environ.get('LTM_MULTI_SERIES_URL_PROD')
+MULTI_SERIES_INSAMPLE_URL = os.environ.get('INSAMPLE_LTM_MULTI_SERIES_URL_PROD')
+
+DEFAULT_START_DATE = '2023-03-01'
+DEFAULT_GROUPING = 'provider'
+
+# Reports are fetched once at this grouping; coarser groupings are aggregated locally from it.
+FINEST_GROUPING = 'provider,service,account_id'
+
+# Grouping that selects the total of the report.
+TOTAL_GROUPING = 'total'
+
+# Group of the cost rows that have no value for a grouping key.
+MISSING_KEY = '(none)'
+
+# Default number of series per multi-series request and of requests in flight.
+BATCH_CHUNK_SIZE = 50
+BATCH_MAX_WORKERS = 4
+
+# Seconds during which the result of a coalesced call is reused by later callers, on any host sharing the backend.
+SINGLE_FLIGHT_TTL = 60
+
+# Where forecasts come from: TimeGPT, the local NumPy engine, or the local engine first with TimeGPT's
+# results replacing its own when TimeGPT answers (the groups TimeGPT fails on keep the local ones).
+FORECAST_ENGINES = ('remote', 'local', 'local-first')
+FORECAST_ENGINE = os.environ.get('VANTAGE_FORECAST_ENGINE', 'remote')
+
+
+################################################
+#  Shared resources
+################################################
+
+# Function to get a pooled Vantage client for a token, shared by every caller of the process.
+@functools.lru_cache(maxsize=None)
+def get_vantage_client(token):
+    return VantageClient(token)
+
+# Function to get the on-disk cost history store shared by every worker on the host.
+@functools.lru_cache(maxsize=None)
+def get_cost_store():
+    return CostStore()
+
+# Function to get the forecast cache shared by every caller of the process.
+@functools.lru_cache(maxsize=None)
+def get_forecast_cache():
+    return ForecastCache()
+
+# Function to get the layer that coalesces identical concurrent requests, across processes when a backend is configured.
+@functools.lru_cache(maxsize=None)
+def get_single_flight():
+    return SingleFlight(ttl=SINGLE_FLIGHT_TTL, backend=backend_from_env())
+
+
+################################################
+#  Fetch and transform
+################################################
+
+def fetch_reports(token):
+    """Return every cost report of the account. Concurrent callers with the same token share one request."""
+    with instrumentation.span('fetch_reports') as span:
+        reports = get_single_flight().do(flight_key('reports', token), get_vantage_client(token).get_reports)
+        span.set(reports=len(reports))
+        return reports
+
+def fetch_costs(token, report_id, grouping=FINEST_GROUPING, start_date=DEFAULT_START_DATE):
+    """Return the costs of a report as a ``costs_frame``. Only the days missing from the on-disk store are requested.
+
+    Stored costs are only served to callers holding the token they were
+    fetched with. Concurrent callers asking for the same report share one
+    refresh, and callers in other processes or hosts that were waiting
+    reuse its result through the single-flight backend.
+    """
+    with instrumentation.span('fetch_costs', report_id=str(report_id), grouping=grouping):
+        refresh = functools.partial(get_cost_store().refresh, get_vantage_client(token), tenant_key(token), report_id, grouping, start_date)
+        key = flight_key('costs', token, report_id, grouping, start_date)
+        return get_single_flight().do(key, refresh, encode=encode_costs, decode=decode_costs)
+
+def costs_frame(data_service):
+    """Load a Vantage costs payload into a columnar frame of parsed dates, float amounts and categorical keys."""
+    # Load every cost row at once and parse all the dates in a single pass
+    costs = pd.DataFrame(data_service["costs"])
+    if costs.empty:
+        return pd.DataFrame({"accrued_at": pd.Series(dtype="datetime64[ns]"), "amount": pd.Series(dtype=float)})
+    costs["accrued_at"] = pd.to_datetime(costs["accrued_at"])
+    costs["amount"] = costs["amount"].astype(float)
+    # Each key repeats a handful of values on every row, so it is stored as codes into its categories
+    keys = [c for c in costs.columns if c not in ("accrued_at", "amount")]
+    costs[keys] = costs[keys].astype("category")
+    return costs
+
+def grouping_keys(grouping):
+    """Parse a grouping such as ``service``, ``provider+service`` or ``total`` into its tuple of keys."""
+    keys = tuple(key.strip() for key in re.split(r'[+,]', grouping or '') if key.strip())
+    return () if keys in ((), (TOTAL_GROUPING,)) else keys
+
+def transform_data(grouping, data_service):
+    """Aggregate the Vantage costs payload (or its ``costs_frame``) into a dense date x group matrix.
+
+    ``grouping`` is one key of the cost rows (``service``), several keys
+    combined with ``+`` (``provider+service``, whose groups are labelled
+    ``aws / EC2``) or ``total`` for a single ``Total`` column. Raises
+    ValueError for an unknown grouping or when there are no costs.
+    """
+    costs = data_service if isinstance(data_service, pd.DataFrame) else costs_frame(data_service)
+    with instrumentation.span('transform_data', grouping=grouping, rows=len(costs)) as span:
+        if costs.empty:
+            # Without rows there are no keys to group by, nor days to forecast
+            raise ValueError('The report has no costs in the requested date range.')
+        keys = list(grouping_keys(grouping))
+        if any(key not in costs.columns for key in keys):
+            # Raise error because grouping is not supported
+            available = ", ".join(c for c in costs.columns if c not in ("accrued_at", "amount"))
+            raise ValueError(f'Grouping is not supported. Please select one of the keys in the report, a combination such as provider+service, or {TOTAL_GROUPING}: {available}')
+
+        # Rows without a value for a key get their own group instead of being dropped by the pivot
+        missing = [key for key in keys if costs[key].isna().any()]
+        if missing:
+            costs = costs.assign(**{key: _fill_missing_key(costs[key]) for key in missing})
+
+        # One column per group, one row per day, summing rows that share a day
+        if not keys:
+            service_data = costs.groupby("accrued_at")["amount"].sum().to_frame("Total")
+        else:
+            service_data = costs.pivot_table(index="accrued_at", columns=keys, values="amount", aggfunc="sum", observed=True)
+            if len(keys) > 1:
+                service_data.columns = [" / ".join(map(str, group)) for group in service_data.columns]
+
+        # Fill missing days so every group shares the same daily index
+        service_data = service_data.asfreq("D").fillna(0.0)
+        service_data.index.name = "date"
+        service_data.columns = service_data.columns.astype(str)
+        span.set(series=service_data.shape[1], days=service_data.shape[0])
+        return service_data
+
+def _fill_missing_key(column):
+    # Label the missing values of a (categorical) key column with MISSING_KEY
+    if isinstance(column.dtype, pd.CategoricalDtype) and MISSING_KEY not in column.cat.categories:
+        column = column.cat.add_categories([MISSING_KEY])
+    return column.fillna(MISSING_KEY)
+
+
+################################################
+#  Forecast
+################################################
+
+def time_gpt(url, series, fh=30, level=(90,), finetune_steps=2, add_ex=True, token=os.environ.get('NIXTLA_TOKEN_PROD'), features=FEATURES):
+    """Fetch time series forecasting results for a ``DailySeries`` from Nixtla, raising on HTTP errors."""
+    # The request body is only materialized for the duration of the call.
+    # With add_ex, the requested calendar features cover the history plus the horizon.
+    x = exogenous_payload(series.start, len(series) + fh, features) if add_ex and features else {}
+    payload = {**series.payload(fh, level, finetune_steps), "x": x}
+
+    with instrumentation.span('timegpt', url=url, series=1, points=len(series)):
+        # Reuse an earlier result for the exact same request.
+        cache = get_forecast_cache()
+        key = forecast_key(url, payload)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Identical requests in flight elsewhere are waited for instead of being sent again.
+        return get_single_flight().do(key, functools.partial(_cached_post, url, payload, token, cache, key))
+
+def _cached_post(url, payload, token, cache, key):
+    # Check the cache again, another caller may have stored the result while this one waited;
+    # the caller's own lookup was already counted as a miss
+    result = cache.get(key, count=False) if cache is not None else None
+    if result is None:
+        result = _post(url, payload, token).json()
+        if cache is not None:
+            cache.set(key, result)
+    return result
+
+def _post(url, payload, token):
+    # POST a TimeGPT request, raising on HTTP errors
+    with instrumentation.span('timegpt.request', url=url) as span:
+        response = requests.post(url, json=payload, headers={"authorization": f"Bearer {token}"})
+        if span:
+            span.set(status=response.status_code, request_bytes=len(response.request.body or b''), response_bytes=len(response.content))
+        response.raise_for_status()
+        return response
+
+def time_gpt_multi_series(url, frame, fh=30, level=(90,), finetune_steps=2, add_ex=True, token=os.environ.get('NIXTLA_TOKEN_PROD'), cache=None, features=FEATURES):
+    """Fetch forecasts for every column of a date x group matrix in one multi-series request."""
+    # Long format rows of (unique_id, ds, y) for all the series in the chunk
+    long = frame.rename_axis('ds').reset_index().melt(id_vars='ds', var_name='unique_id', value_name='y')
+    long['ds'] = long['ds'].dt.strftime('%Y-%m-%d')
+    data = {
+        "y": {"columns": ["unique_id", "ds", "y"], "data": long[["unique_id", "ds", "y"]].values.tolist()},
+        "fh": fh,
+        "level": list(level),
+        "finetune_steps": finetune_steps,
+        "x": {},
+    }
+    if add_ex and features:
+        # Every series shares the same calendar, so the features are computed once and tiled per series
+        calendar = calendar_features(frame.index[0], len(frame) + fh, features)
+        ds = np.tile(calendar.index.strftime('%Y-%m-%d').to_numpy(), frame.shape[1])
+        unique_id = np.repeat(frame.columns.to_numpy(), len(calendar))
+        values = np.tile(calendar.to_numpy(), (frame.shape[1], 1))
+        ex = pd.DataFrame(values, columns=calendar.columns).assign(unique_id=unique_id, ds=ds)
+        columns = ["unique_id", "ds", *calendar.columns]
+        data["x"] = {"columns": columns, "data": ex[columns].values.tolist()}
+
+    # Reuse an earlier response for the exact same chunk, otherwise POST it; errors are raised to the caller.
+    with instrumentation.span('timegpt.multi_series', url=url, series=frame.shape[1], points=frame.size):
+        key = forecast_key(url, data)
+        result = cache.get(key) if cache is not None else None
+        if result is None:
+            result = get_single_flight().do(key, functools.partial(_cached_post, url, data, token, cache, key))
+    forecast = result['data']['forecast']
+
+    # Split the long response back into one single-series result per group
+    forecast = pd.DataFrame(forecast['data'], columns=forecast['columns'])
+    forecast = forecast.rename(columns=lambda c: {'ds': 'timestamp', 'TimeGPT': 'value'}.get(c, c.replace('TimeGPT-', '')))
+    return {
+        str(uid): {"data": group.drop(columns='unique_id').to_dict(orient='list')}
+        for uid, group in forecast.groupby('unique_id', sort=False)
+    }
+
+class GroupResults(dict):
+    """TimeGPT-like results per group, with the reason each group that TimeGPT did not answer for is in ``failed``."""
+
+    def __init__(self, results=(), failed=None):
+        super().__init__(results)
+        self.failed = dict(failed or {})
+
+def forecast_all_groups(url, frame, add_ex=True, chunk_size=BATCH_CHUNK_SIZE, max_workers=BATCH_MAX_WORKERS, **kwargs):
+    """Forecast every group of a report in chunked multi-series requests run by a bounded worker pool.
+
+    Returns ``GroupResults``: groups of a chunk whose request fails are
+    logged, left out of the results and listed in ``failed``.
+    """
+    chunks = [frame.iloc[:, i:i + chunk_size] for i in range(0, frame.shape[1], chunk_size)]
+    kwargs.setdefault('cache', get_forecast_cache())
+    results = GroupResults()
+    with instrumentation.span('forecast_all_groups', url=url, series=frame.shape[1], chunks=len(chunks)) as span:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(instrumentation.in_context(time_gpt_multi_series), url, chunk, add_ex=add_ex, **kwargs) for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                try:
+                    results.update(future.result())
+                except requests.exceptions.RequestException as err:
+                    logger.warning('Request failed forecasting %s: %s', list(chunk.columns), err)
+                    span.count('failed_chunks')
+                    results.failed.update(dict.fromkeys(map(str, chunk.columns), str(err)))
+    return results
+
+def _check_engine(engine):
+    if engine not in FORECAST_ENGINES:
+        raise ValueError(f'Unknown forecast engine {engine!r}, expected one of {FORECAST_ENGINES}')
+
+def forecast_series(series, insample=False, engine=FORECAST_ENGINE, fh=30, level=(90,)):
+    """Forecast a ``DailySeries`` (or predict it in sample) with the selected engine, as a TimeGPT response.
+
+    ``remote`` raises on request errors; ``local-first`` answers with the
+    local result instead.
+    """
+    _check_engine(engine)
+    if engine != 'remote':
+        local = local_forecast.insample if insample else functools.partial(local_forecast.forecast, fh=fh)
+        result = local(series.to_frame('y'), level=level)['y']
+        if engine == 'local':
+            return result
+    try:
+        return time_gpt(INSAMPLE_URL if insample else FORECAST_URL, series, fh=fh, level=level, add_ex=not insample)
+    except requests.exceptions.RequestException as err:
+        if engine == 'remote':
+            raise
+        logger.warning('TimeGPT request failed, using the local forecast: %s', err)
+        return result
+
+def forecast_groups(frame, insample=False, engine=FORECAST_ENGINE, fh=30, level=(90,), chunk_size=BATCH_CHUNK_SIZE, max_workers=BATCH_MAX_WORKERS, local=None):
+    """Forecast (or predict in sample) every group of a date x group matrix with the selected engine.
+
+    With ``local-first`` every group gets a local result, replaced by
+    TimeGPT's for the groups it answers. ``local`` passes local results that
+    were already computed for the same request. Returns ``GroupResults``
+    whose ``failed`` lists the groups TimeGPT did not answer for.
+    """
+    _check_engine(engine)
+    results = GroupResults()
+    if engine != 'remote':
+        if local is None:
+            local = local_forecast.insample(frame, level=level) if insample else local_forecast.forecast(frame, fh=fh, level=level)
+        results = GroupResults(local)
+        if engine == 'local':
+            return results
+    url = MULTI_SERIES_INSAMPLE_URL if insample else MULTI_SERIES_FORECAST_URL
+    try:
+        answered = forecast_all_groups(url, frame, add_ex=not insample, chunk_size=chunk_size, max_workers=max_workers, fh=fh, level=level)
+    except requests.exceptions.RequestException as err:
+        if engine == 'remote':
+            raise
+        logger.warning('TimeGPT request failed, using the local forecasts: %s', err)
+        answered = GroupResults(failed=dict.fromkeys(map(str, frame.columns), str(err)))
+    results.update(answered)
+    results.failed.update(answered.failed)
+    return results
+
+
+################################################
+#  Explain
+################################################
+
+# Function to get the anomaly explainer shared by every caller of the process.
+@functools.lru_cache(maxsize=None)
+def get_explainer():
+    return Explainer()
+
+def explain_all(anomalies):
+    """Explain the anomalies of every group of an anomaly table, batching the cache misses."""
+    return get_explainer().explain(anomalies)
+
+
+################################################
+#  Pipeline
+################################################
+
+# Stage functions of the report pipeline, called with the outputs of their upstream stages.
+def _fetch_stage(token, report_id, start_date):
+    return fetch_costs(token, report_id, FINEST_GROUPING, start_date)
+
+def _local_forecast_stage(data, local):
+    return local_forecast.forecast(data) if local else None
+
+def _local_insample_stage(data, local):
+    return local_forecast.insample(data) if local else None
+
+def _forecast_stage(data, local, engine, chunk_size, max_workers):
+    return forecast_groups(data, engine=engine, chunk_size=chunk_size, max_workers=max_workers, local=local)
+
+def _insample_stage(data, local, engine, chunk_size, max_workers):
+    return forecast_groups(data, insample=True, engine=engine, chunk_size=chunk_size, max_workers=max_workers, local=local)
+
+def _answered_all(results):
+    # Results with groups TimeGPT did not answer for are not memoized, so they are asked for again on the next run
+    return not results.failed
+
+# fetch -> transform -> local forecast / in-sample -> forecast / in-sample -> anomalies -> explain
+# The fetch does not depend on the grouping: changing it only re-aggregates the fetched costs.
+# The local results only depend on whether the engine uses them, so the local and local-first engines share them,
+# and two memos per stage let the app alternate between its local preview and its final results.
+REPORT_STAGES = StageGraph(memo_size=2)
+REPORT_STAGES.add('fetch', _fetch_stage, params=('token', 'report_id', 'start_date'), ttl=1000, fingerprint=fingerprint)
+REPORT_STAGES.add('transform', lambda costs, grouping: transform_data(grouping, costs), params=('grouping',), upstream=('fetch',))
+REPORT_STAGES.add('local_forecast', _local_forecast_stage, params=('local',), upstream=('transform',))
+REPORT_STAGES.add('local_insample', _local_insample_stage, params=('local',), upstream=('transform',))
+REPORT_STAGES.add('forecast', _forecast_stage, params=('engine', 'chunk_size', 'max_workers'), upstream=('transform', 'local_forecast'), memoize=_answered_all)
+REPORT_STAGES.add('insample', _insample_stage, params=('engine', 'chunk_size', 'max_workers'), upstream=('transform', 'local_insample'), memoize=_answered_all)
+REPORT_STAGES.add('anomalies', detect_anomalies, upstream=('transform', 'insample'))
+REPORT_STAGES.add('explain', explain_all, upstream=('anomalies',))
+
+def run_report(token, report_id, grouping=DEFAULT_GROUPING, start_date=DEFAULT_START_DATE, explain=True,
+               chunk_size=BATCH_CHUNK_SIZE, max_workers=BATCH_MAX_WORKERS, state=None, engine=FORECAST_ENGINE):
+    """Run the whole pipeline for one report and grouping.
+
+    Returns a dict with the date x group cost matrix (``data``), the per-group
+    forecasts and in-sample predictions of the ``engine`` (see
+    ``FORECAST_ENGINES``), the anomaly table of every group and, when
+    ``explain`` is set, a GPT-4 explanation per group with anomalies.
+
+    Stage outputs are memoized in ``state``. Passing the same mapping again,
+    e.g. across Streamlit reruns, only recomputes the stages whose inputs
+    changed. Forecasts with groups TimeGPT did not answer for (listed in
+    their ``failed``) are not memoized, so those groups are retried.
+    """
+    state = {} if state is None else state
+    params = dict(token=token, report_id=report_id, grouping=grouping, start_date=start_date,
+                  engine=engine, local=engine != 'remote', chunk_size=chunk_size, max_workers=max_workers)
+    with instrumentation.span('run_report', report_id=str(report_id), grouping=grouping):
+        return {
+            'report_id': report_id,
+            'grouping': grouping,
+            'data': REPORT_STAGES.run('transform', state, **params),
+            'forecasts': REPORT_STAGES.run('forecast', state, **params),
+            'insample': REPORT_STAGES.run('insample', state, **params),
+            'anomalies': REPORT_STAGES.run('anomalies', state, **params),
+            'explanations': REPORT_STAGES.run('explain', state, **params) if explain else {},
+        }
+
+# Function to get the incremental anomaly monitor shared by every caller of the process.
+@functools.lru_cache(maxsize=None)
+def get_monitor():
+    return AnomalyMonitor()
+
+def monitor_report(token, report_id, grouping=DEFAULT_GROUPING, start_date=DEFAULT_START_DATE,
+                   chunk_size=BATCH_CHUNK_SIZE, max_workers=BATCH_MAX_WORKERS, monitor=None, engine=FORECAST_ENGINE):
+    """Score only the days of a report that arrived since its previous run and return their anomalies.
+
+    Only the missing days are fetched, and only the new days of each group
+    are forecast (from a rolling window of context) and scored. Groups seen
+    for the first time are scored once on their whole history. The last days,
+    which may still be restated, wait until they have settled. The returned
+    anomalies are also appended to the monitor's anomaly log.
+    """
+    monitor = get_monitor() if monitor is None else monitor
+    data = transform_data(grouping, fetch_costs(token, report_id, FINEST_GROUPING, start_date))
+    batch = dict(engine=engine, chunk_size=chunk_size, max_workers=max_workers)
+    return monitor.update(
+        report_id, grouping, data,
+        forecast=lambda frame, fh: forecast_groups(frame, fh=fh, **batch),
+        insample=lambda frame: forecast_groups(frame, insample=True, **batch),
+    )
+
+def forecasts_table(results):
+    """Stack per-group TimeGPT results into one long table with a ``group`` column."""
+    frames = [pd.DataFrame(result['data']).assign(group=group) for group, result in results.items()]
+    if not frames:
+        return pd.DataFrame(columns=['group', 'timestamp', 'value'])
+    table = pd.concat(frames, ignore_index=True)
+    return table[['group', *[c for c in table.columns if c != 'group']]]
+
+def write_report(report, output_dir, fmt='json'):
+    """Write the forecasts, anomalies and explanations of a report to ``output_dir``.
+
+    Tables are written as Parquet (requires pyarrow) or JSON records; the
+    explanations are always written as JSON. Returns the written paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = os.path.join(output_dir, f"{report['report_id']}_{report['grouping']}")
+    tables = {'forecasts': forecasts_table(report['forecasts']), 'anomalies': report['anomalies']}
+    paths = [write_table(table, f'{prefix}_{name}.{fmt}', fmt) for name, table in tables.items()]
+    path = f'{prefix}_explanations.json'
+    with open(path, 'w') as f:
+        json.dump(report['explanations'], f, indent=2)
+    paths.append(path)
+    return paths
+
+def write_table(table, path, fmt='json'):
+    """Write a table as Parquet (requires pyarrow) or JSON records and return its path."""
+    if fmt == 'parquet':
+        table.to_parquet(path, index=False)
+    else:
+        table.to_json(path, orient='records', date_format='iso')
+    return path
+
+def run_reports(token, specs, workers=4, runner=run_report, **kwargs):
+    """Run the pipeline (or another ``runner`` such as ``monitor_report``) for many ``(report_id, grouping)`` pairs concurrently.
+
+    Returns a dict mapping each pair to its result, or to the exception that stopped it.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {spec: pool.submit(runner, token, *spec, **kwargs) for spec in specs}
+        for spec, future in futures.items():
+            try:
+                results[spec] = future.result()
+            except Exception as err:
+                # One failing report must not stop the rest of the batch
+                logger.error('Report %s grouped by %s failed: %s', *spec, err)
+                results[spec] = err
+    return results
+
+
+################################################
+#  Command line
+################################################
+
+def parse_spec(value, default_grouping=DEFAULT_GROUPING):
+    """Parse a ``REPORT_ID[:GROUPING]`` command line argument."""
+    report_id, _, grouping = value.partition(':')
+    return report_id, grouping or default_grouping
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Forecast Vantage cost reports with TimeGPT and detect anomalies.')
+    parser.add_argument('reports', nargs='+', metavar='REPORT_ID[:GROUPING]', help='reports to process, e.g. 3637:account_id')
+    parser.add_argument('--grouping', default=DEFAULT_GROUPING, help='grouping used when a report does not specify one, e.g. service, provider+service or total')
+    parser.add_argument('--start-date', default=DEFAULT_START_DATE, help='first day of cost history (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=4, help='number of reports processed concurrently')
+    parser.add_argument('--batch-size', type=int, default=BATCH_CHUNK_SIZE, help='series per multi-series TimeGPT request')
+    parser.add_argument('--output-dir', default='output', help='directory where results are written')
+    parser.add_argument('--format', choices=['json', 'parquet'], default='json', help='format of the forecast and anomaly tables')
+    parser.add_argument('--no-explain', action='store_true', help='skip the GPT-4 explanations')
+    parser.add_argument('--engine', choices=FORECAST_ENGINES, default=FORECAST_ENGINE, help='forecast with TimeGPT (remote), the local NumPy engine (local), or TimeGPT with local fallbacks (local-first)')
+    parser.add_argument('--monitor', action='store_true', help='only score the days that arrived since the previous run and write their anomalies')
+    parser.add_argument('--token', default=os.environ.get('VANTAGE_TOKEN'), help='Vantage API token (defaults to $VANTAGE_TOKEN)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    specs = list(dict.fromkeys(parse_spec(value, args.grouping) for value in args.reports))
+    if args.monitor:
+        results = run_reports(
+            args.token, specs, workers=args.workers, runner=monitor_report, start_date=args.start_date,
+            chunk_size=args.batch_size, engine=args.engine,
+        )
+    else:
+        results = run_reports(
+            args.token, specs, workers=args.workers, start_date=args.start_date,
+            explain=not args.no_explain, chunk_size=args.batch_size, engine=args.engine,
+        )
+    os.makedirs(args.output_dir, exist_ok=True)
+    failed = 0
+    for (report_id, grouping), report in results.items():
+        if isinstance(report, Exception):
+            failed += 1
+        elif args.monitor:
+            path = write_table(report, os.path.join(args.output_dir, f'{report_id}_{grouping}_new_anomalies.{args.format}'), args.format)
+            logger.info('Wrote %d new anomalies to %s', len(report), path)
+        else:
+            for path in write_report(report, args.output_dir, args.format):
+                logger.info('Wrote %s', path)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Plotly helpers that stay responsive on long, many-group series."""
+# Import required libraries
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# Traces with more points than this are rendered with WebGL instead of SVG.
+WEBGL_THRESHOLD = 1000
+
+# Traces with more points than this are downsampled before being sent to the browser.
+MAX_POINTS = 2000
+
+
+def _as_numeric(x):
+    """Return x as a float array; dates (or date strings) become nanoseconds since the epoch."""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.number):
+        return x.astype(float)
+    return pd.to_datetime(x).asi8.astype(float)
+
+
+def lttb_indices(x, y, n_out):
+    """Return the indices of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are always kept; every bucket in between keeps
+    the point forming the largest triangle with the previously kept point and
+    the average of the next bucket, which preserves the visual shape of the
+    series (peaks and troughs included).
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def downsample(x, *ys, max_points=MAX_POINTS, keep=None):
+    """Downsample x and one or more aligned y arrays with LTTB on the first y.
+
+    Points whose x value is in ``keep`` (e.g. anomaly dates) are always kept.
+    Returns NumPy arrays; inputs with at most ``max_points`` points are returned whole.
+    """
+    x = np.asarray(x)
+    ys = [np.asarray(y, dtype=float) for y in ys]
+    if len(x) <= max_points:
+        return (x, *ys)
+    x_numeric = _as_numeric(x)
+    indices = lttb_indices(x_numeric, ys[0], max_points)
+    if keep is not None and len(keep):
+        indices = np.union1d(indices, np.flatnonzero(np.isin(x_numeric, _as_numeric(keep))))
+    return (x[indices], *(y[indices] for y in ys))
+
+
+def _scatter(n_points, **kwargs):
+    # WebGL traces draw large point counts much faster than SVG ones
+    return go.Scattergl(**kwargs) if n_points > WEBGL_THRESHOLD else go.Scatter(**kwargs)
+
+
+# Function to create a figure with a specific title and axis labels.
+def create_figure(title, xaxis_title, yaxis_title, yaxis_range=None):
+    # Create a new Plotly Figure.
+    fig = go.Figure()
+
+    # Update the layout of the figure with the specified parameters.
+    fig.update_layout(
+        title=title,
+        xaxis_title=xaxis_title,
+        yaxis_title=yaxis_title,
+        autosize=False,
+        width=800,
+        height=500,
+        yaxis=dict(range=yaxis_range) if yaxis_range else None,
+    )
+
+    # Return the figure.
+    return fig
+
+# Function to add a scatter trace to a figure.
+# Long series are downsampled, always keeping the points whose x is in `keep`.
+def add_trace(fig, x, y, mode, name, keep=None):
+    x, y = downsample(x, y, keep=keep)
+    fig.add_trace(_scatter(len(x), x=x, y=y, mode=mode, name=name))
+
+    # Return the figure with the added trace.
+    return fig
+
+# Function to add a confidence interval to a figure.
+def add_confidence_interval(fig, x, lo, hi, color='rgba(0,176,246,0.2)'):
+    x, hi, lo = downsample(x, hi, lo)
+    # Create a scatter trace for the confidence interval; the closed band is built from arrays, without list copies.
+    fig.add_trace(_scatter(
+        2 * len(x),
+        x=np.concatenate([x, x[::-1]]),  # X coordinates for the filled area.
+        y=np.concatenate([hi, lo[::-1]]),  # Y coordinates for the filled area.
+        fill='toself',  # The area under the trace is filled.
+        fillcolor=color,  # The fill color.
+        line_color='rgba(255,255,255,0)',  # The line color.
+        showlegend=False,  # The trace is not added to the legend.
+        name='Confidence Interval',
+    ))
+
+    # Return the figure with the added confidence interval.
+    return fig
+
+# Function to add the confidence interval of in-sample predictions and mark the anomalies outside of it.
+def add_confidence_interval_anomalies(fig, x, lower_bound, upper_bound, anomalies):
+    # Add the lower and upper bounds of the confidence interval as lines to the figure
+    x, upper_bound, lower_bound = downsample(x, upper_bound, lower_bound, keep=anomalies['date'])
+    fig.add_trace(_scatter(len(x), x=x, y=lower_bound, fill=None, mode='lines', line_color='rgba(68, 68, 68, 0.2)', name='90% Confidence Interval'))
+    fig.add_trace(_scatter(len(x), x=x, y=upper_bound, fill='tonexty', mode='lines', line_color='rgba(68, 68, 68, 0.2)', name='90% Confidence Interval'))
+
+    # Add the anomalies from the anomaly table: spikes in red, drops in orange
+    spikes = anomalies[anomalies['direction'] == 'spike']
+    drops = anomalies[anomalies['direction'] == 'drop']
+    fig.add_trace(_scatter(len(spikes), x=spikes['date'], y=spikes['y'], mode='markers', marker=dict(color='red', size=10), name='Above Confidence Interval'))
+    fig.add_trace(_scatter(len(drops), x=drops['date'], y=drops['y'], mode='markers', marker=dict(color='orange', size=10), name='Below Confidence Interval'))
+    return fig
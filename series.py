@@ -0,0 +1,55 @@
+"""Compact, array-backed daily series."""
+# Import required libraries
+import numpy as np
+import pandas as pd
+
+
+class DailySeries:
+    """A regular series stored as its first date, its frequency and a float64 array.
+
+    It holds 8 bytes per point instead of the string key and Python float of
+    a ``{date: value}`` dict, and only materializes dates or the TimeGPT
+    request body when asked to.
+    """
+
+    __slots__ = ('start', 'freq', 'values')
+
+    def __init__(self, start, values, freq='D'):
+        self.start = pd.Timestamp(start)
+        self.freq = freq
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_costs(cls, costs):
+        """Build the daily total of a costs frame, summing the rows of a day and filling missing days with 0."""
+        if costs.empty:
+            return cls('1970-01-01', [])
+        days = costs['accrued_at'].to_numpy(dtype='datetime64[D]')
+        amounts = costs['amount'].to_numpy(dtype=np.float64)
+        start = days.min()
+        offsets = (days - start).astype(np.int64)
+        return cls(start, np.bincount(offsets, weights=amounts))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return f'DailySeries(start={self.start.date()}, freq={self.freq!r}, length={len(self)})'
+
+    @property
+    def dates(self):
+        """The DatetimeIndex of the series, computed on demand."""
+        return pd.date_range(self.start, periods=len(self.values), freq=self.freq)
+
+    def to_frame(self, name):
+        """Return the series as a one-column date x group matrix, e.g. for ``detect_anomalies``."""
+        return pd.DataFrame({name: self.values}, index=self.dates)
+
+    def payload(self, fh=30, level=(90,), finetune_steps=2):
+        """Return the single-series TimeGPT request body, ``{"y": {date: value}, ...}``."""
+        return {
+            "y": dict(zip(self.dates.strftime('%Y-%m-%d'), self.values.tolist())),
+            "fh": fh,
+            "level": list(level),
+            "finetune_steps": finetune_steps,
+        }
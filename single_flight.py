@@ -0,0 +1,202 @@
+"""Coalesce concurrent identical requests into a single call.
+
+``SingleFlight.do(key, fn)`` runs ``fn`` once for all the callers that ask
+for the same key at the same time: the first caller runs it and the others
+wait for its result (or its exception). Results can be kept for a few
+seconds so that callers arriving right after the call also reuse them.
+
+Within a process this needs nothing else. A backend extends it across
+worker processes: the call runs under a lock shared by every process, and
+results kept with a ``ttl`` are shared through the backend, so processes
+that waited for the lock reuse them instead of making the call again. ``FileBackend`` uses file locks and
+a SQLite file on the host; ``RedisBackend`` wraps any Redis-compatible
+client for processes spread over several hosts.
+"""
+# Import required libraries
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import instrumentation
+from sqlite_store import SQLiteCache
+
+
+def flight_key(*parts):
+    """Return a stable hash of a JSON-like key, so secrets such as tokens never end up in lock names."""
+    canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class _Call:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run each call once for all its concurrent callers and share the result.
+
+    ``ttl`` is the number of seconds a result is reused after its call has
+    finished (0 to only share it with the callers that were waiting).
+    ``backend`` optionally shares calls and results across processes.
+    """
+
+    def __init__(self, ttl=0, backend=None):
+        self.ttl = ttl
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._results = {}
+
+    def do(self, key, fn, ttl=None, encode=None, decode=None):
+        """Return ``fn()``, or the result of an identical call that is in flight or finished less than ``ttl`` seconds ago.
+
+        ``encode`` and ``decode`` convert a result that is not JSON-like to and
+        from the value shared through the backend.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None and result[0] > now:
+                instrumentation.count('single_flight_reused')
+                return result[1]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            # Another thread is already making this call: wait for it and share its outcome
+            instrumentation.count('single_flight_waited')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self._run(key, fn, ttl, encode, decode)
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None and ttl:
+                    expires_at = time.monotonic() + ttl
+                    self._results = {k: v for k, v in self._results.items() if v[0] > now}
+                    self._results[key] = (expires_at, call.value)
+            call.done.set()
+        return call.value
+
+    def _run(self, key, fn, ttl, encode, decode):
+        if self.backend is None:
+            return fn()
+        with self.backend.lock(key):
+            # Another process may have made the call while this one waited for the lock
+            if ttl:
+                value = self.backend.get(key)
+                if value is not None:
+                    instrumentation.count('single_flight_reused')
+                    return decode(value) if decode is not None else value
+            value = fn()
+            if ttl:
+                self.backend.set(key, encode(value) if encode is not None else value, ttl)
+            return value
+
+    def clear(self):
+        """Forget the results kept in this process."""
+        with self._lock:
+            self._results.clear()
+
+
+################################################
+#  Backends
+################################################
+
+class FileBackend:
+    """Share calls between the processes of one host through file locks and a SQLite file in ``directory``.
+
+    Keys are spread over a fixed set of ``stripes`` lock files, so the
+    directory does not grow with the number of distinct calls. Two keys of
+    the same stripe are serialized, but each still makes its own call.
+    """
+
+    def __init__(self, directory, max_ttl=3600, stripes=256):
+        self.directory = directory
+        self.stripes = stripes
+        os.makedirs(directory, exist_ok=True)
+        self.results = SQLiteCache(
+            os.path.join(directory, 'results.sqlite'), table='results', metric='single_flight_cache', memory_entries=0, disk_ttl=max_ttl
+        )
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        stripe = int(hashlib.sha256(key.encode()).hexdigest(), 16) % self.stripes
+        with open(os.path.join(self.directory, f'{stripe:03d}.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, key):
+        entry = self.results.get(key)
+        if entry is None or entry['expires_at'] < time.time():
+            return None
+        return entry['value']
+
+    def set(self, key, value, ttl):
+        self.results.set(key, {'expires_at': time.time() + ttl, 'value': value})
+
+
+class RedisBackend:
+    """Share calls between processes on any host through a Redis-compatible client.
+
+    ``client`` needs the ``get``, ``set`` (with ``nx``, ``px`` and ``ex``) and
+    ``delete`` methods of ``redis.Redis``. A lock is released after
+    ``lock_timeout`` seconds even if its holder died.
+    """
+
+    def __init__(self, client, prefix='vantage:single-flight:', lock_timeout=300, poll_interval=0.05):
+        self.client = client
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        name, token = f'{self.prefix}lock:{key}', uuid.uuid4().hex
+        while not self.client.set(name, token, nx=True, px=int(self.lock_timeout * 1000)):
+            time.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            owner = self.client.get(name)
+            if owner in (token, token.encode()):
+                self.client.delete(name)
+
+    def get(self, key):
+        value = self.client.get(f'{self.prefix}{key}')
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(f'{self.prefix}{key}', json.dumps(value), ex=max(1, int(ttl)))
+
+
+def backend_from_env():
+    """Return the backend configured by ``VANTAGE_REDIS_URL`` (requires redis) or ``VANTAGE_SINGLE_FLIGHT_DIR``, if any."""
+    if os.environ.get('VANTAGE_REDIS_URL'):
+        import redis
+        return RedisBackend(redis.Redis.from_url(os.environ['VANTAGE_REDIS_URL']))
+    if os.environ.get('VANTAGE_SINGLE_FLIGHT_DIR'):
+        return FileBackend(os.environ['VANTAGE_SINGLE_FLIGHT_DIR'])
+    return None
@@ -0,0 +1,160 @@
+"""SQLite connections and a two-tier key-value cache shared by the on-disk stores."""
+# Import required libraries
+import collections
+import contextlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def connect(path):
+    """Open a short-lived connection to ``path``, committed on success and rolled back on error.
+
+    One connection per call keeps a store safe to use from any thread or process.
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def open_store(path, schema):
+    """Create the directory and the tables of the SQLite file at ``path``, in WAL mode."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with connect(path) as conn:
+        conn.executescript(schema)
+    # The journal mode is stored in the file, so it is only switched once, here
+    try:
+        with connect(path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.OperationalError as err:
+        # Another process is opening the same file; it switches the mode instead
+        logger.debug('Could not switch %s to WAL mode: %s', path, err)
+
+
+class SQLiteCache:
+    """LRU cache of JSON values with an in-memory tier backed by a size-bounded SQLite tier.
+
+    Lookups try the memory tier first and then the disk tier, promoting disk
+    hits back into memory. Both tiers evict the least recently used entries
+    and expire entries older than their TTL. Cached values are shared, so
+    callers must treat them as read-only. Entries live in ``table`` of
+    ``path`` (memory only when ``path`` is None), and lookups are counted on
+    the current span as ``<metric>_hit_memory``, ``<metric>_hit_disk`` and
+    ``<metric>_miss``.
+    """
+
+    def __init__(self, path, table='entries', metric='cache', memory_entries=256, memory_ttl=3600,
+                 disk_max_bytes=256 * 1024 ** 2, disk_ttl=7 * 24 * 3600):
+        if not re.fullmatch(r'\w+', table):
+            raise ValueError(f'Invalid table name {table!r}')
+        self.path = path
+        self.table = table
+        self.metric = metric
+        self.memory_entries = memory_entries
+        self.memory_ttl = memory_ttl
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_ttl = disk_ttl
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            open_store(path, f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS {table}_by_access ON {table} (accessed_at);
+            ''')
+
+    def get(self, key, count=True):
+        """Return the cached value for ``key``, or None on a miss.
+
+        With ``count`` false the lookup is not counted, e.g. when re-checking
+        a key whose lookup was already counted as a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.memory_ttl:
+                    self._memory.move_to_end(key)
+                    self._count('hit_memory', count)
+                    return value
+                del self._memory[key]
+
+        if self.path is None:
+            self._count('miss', count)
+            return None
+        with connect(self.path) as conn:
+            row = conn.execute(f'SELECT value, created_at FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._count('miss', count)
+                return None
+            if now - row[1] > self.disk_ttl:
+                conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                self._count('miss', count)
+                return None
+            conn.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?', (now, key))
+        value = json.loads(row[0])
+        self._remember(key, value, now)
+        self._count('hit_disk', count)
+        return value
+
+    def _count(self, outcome, count):
+        if count:
+            instrumentation.count(f'{self.metric}_{outcome}')
+
+    def set(self, key, value):
+        """Store ``value`` under ``key`` in both tiers."""
+        now = time.time()
+        self._remember(key, value, now)
+        if self.path is None:
+            return
+        encoded = json.dumps(value)
+        with connect(self.path) as conn:
+            conn.execute(
+                f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?)', (key, encoded, len(encoded), now, now)
+            )
+            self._evict_disk(conn, now)
+
+    def _remember(self, key, value, now):
+        with self._lock:
+            self._memory[key] = (now, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self, conn, now):
+        # Drop expired entries, then the least recently used ones until the tier fits its size budget.
+        conn.execute(f'DELETE FROM {self.table} WHERE created_at < ?', (now - self.disk_ttl,))
+        total = conn.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.table}').fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+        for key, size in conn.execute(f'SELECT key, size FROM {self.table} ORDER BY accessed_at').fetchall():
+            conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+            total -= size
+            if total <= self.disk_max_bytes:
+                break
+
+    def clear(self):
+        """Empty both tiers."""
+        with self._lock:
+            self._memory.clear()
+        if self.path is not None:
+            with connect(self.path) as conn:
+                conn.execute(f'DELETE FROM {self.table}')
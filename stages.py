@@ -0,0 +1,84 @@
+"""Dependency-tracked pipeline stages memoized on their inputs."""
+# Import required libraries
+import hashlib
+import json
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+import instrumentation
+
+Stage = namedtuple('Stage', ['fn', 'params', 'upstream', 'ttl', 'fingerprint', 'memoize'])
+
+
+def fingerprint(value):
+    """Return a stable hash of a JSON-like value or of a DataFrame."""
+    if isinstance(value, pd.DataFrame):
+        digest = hashlib.sha256(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+        digest.update(json.dumps([list(map(str, value.columns)), list(map(str, value.dtypes))]).encode())
+        return digest.hexdigest()
+    canonical = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class StageGraph:
+    """A graph of stages that only recompute when one of their inputs changes.
+
+    Each stage is a function called with the outputs of its upstream stages
+    (positionally, in order) and its own parameters (as keywords). Its output
+    is memoized in a caller-provided ``state`` mapping, such as a Streamlit
+    session state entry, under a key made of its parameters and the versions
+    of its upstream stages. Running a stage runs its upstream stages first,
+    so a change anywhere upstream invalidates everything below it, while
+    unrelated changes reuse the memoized outputs.
+
+    A stage with a ``ttl`` is recomputed once its output is older than
+    ``ttl`` seconds. With a ``fingerprint`` function, its version is the
+    fingerprint of its output instead of its input key, so downstream stages
+    are only invalidated when the refreshed output actually differs. With a
+    ``memoize`` predicate, outputs it rejects (e.g. partial results) are not
+    memoized, so the stage and everything below it run again next time.
+
+    Each stage keeps the outputs of its ``memo_size`` most recent input keys,
+    so callers alternating between a few parameter sets reuse all of them.
+    """
+
+    def __init__(self, memo_size=1):
+        self.stages = {}
+        self.memo_size = memo_size
+
+    def add(self, name, fn, params=(), upstream=(), ttl=None, fingerprint=None, memoize=None):
+        """Register a stage; upstream stages must be registered first."""
+        missing = [stage for stage in upstream if stage not in self.stages]
+        if missing:
+            raise ValueError(f'Stage {name!r} depends on unknown stages: {missing}')
+        self.stages[name] = Stage(fn, tuple(params), tuple(upstream), ttl, fingerprint, memoize)
+
+    def run(self, name, state, **params):
+        """Return the output of a stage, recomputing it and its upstream stages only when needed."""
+        return self._run(name, state, params)[0]
+
+    def _run(self, name, state, params):
+        stage = self.stages[name]
+        upstream = [self._run(dependency, state, params) for dependency in stage.upstream]
+        key = fingerprint([name, {param: params[param] for param in stage.params}, [version for _, version in upstream]])
+
+        # Memos of the stage by input key, from the least to the most recently used
+        memos = state.setdefault(name, {})
+        memo = memos.pop(key, None)
+        now = time.time()
+        if memo is not None and (stage.ttl is None or now - memo['computed_at'] < stage.ttl):
+            memos[key] = memo
+            return memo['value'], memo['version']
+
+        with instrumentation.span(f'stage.{name}'):
+            value = stage.fn(*(value for value, _ in upstream), **{param: params[param] for param in stage.params})
+        version = stage.fingerprint(value) if stage.fingerprint is not None else key
+        if stage.memoize is not None and not stage.memoize(value):
+            # A fresh version, so no downstream memo is ever reused for this output
+            return value, fingerprint([key, now])
+        memos[key] = {'version': version, 'value': value, 'computed_at': now}
+        while len(memos) > self.memo_size:
+            del memos[next(iter(memos))]
+        return value, version
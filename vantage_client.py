@@ -0,0 +1,127 @@
+"""Pooled, paginated Vantage API client."""
+# Import required libraries
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import instrumentation
+
+VANTAGE_API_URL = os.environ.get("VANTAGE_API_URL", "https://api.vantage.sh/v1")
+
+# Status codes that are worth retrying: rate limiting and transient server errors.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class VantageClient:
+    """Client for the Vantage REST API.
+
+    A single ``requests.Session`` keeps connections alive across calls, retries
+    429/5xx responses with exponential backoff, and fetches the pages of a
+    paginated endpoint concurrently.
+    """
+
+    def __init__(self, token, base_url=VANTAGE_API_URL, max_retries=3, backoff_factor=0.5,
+                 max_workers=4, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+        # Retry idempotent GETs on rate limiting and server errors, honouring Retry-After.
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"accept": "application/json", "authorization": f"Bearer {token}"})
+
+    def get(self, path, params=None):
+        """GET a single page and return its JSON body, raising on HTTP errors."""
+        with instrumentation.span("vantage.request", path=path, page=(params or {}).get("page", 1)) as span:
+            response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+            if span:
+                retries = getattr(response.raw, "retries", None)
+                span.set(status=response.status_code, response_bytes=len(response.content),
+                         retries=len(retries.history) if retries is not None else 0)
+            response.raise_for_status()
+            return response.json()
+
+    def iter_pages(self, path, params=None):
+        """Yield every page of a paginated endpoint.
+
+        The first page is fetched on its own to learn the page count from its
+        ``links.last`` URL; the remaining pages are then fetched concurrently,
+        at most ``max_workers`` ahead of the consumer, and yielded in order.
+        Endpoints that only expose a ``next`` link are followed sequentially.
+        """
+        params = dict(params or {})
+        page = self.get(path, params)
+        yield page
+
+        last_page = _page_number(page.get("links", {}).get("last"))
+        if last_page is None:
+            # No page count available, walk the next links one at a time.
+            next_page = _page_number(page.get("links", {}).get("next"))
+            while next_page is not None:
+                page = self.get(path, {**params, "page": next_page})
+                yield page
+                next_page = _page_number(page.get("links", {}).get("next"))
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = []
+            for number in range(2, last_page + 1):
+                pending.append(pool.submit(instrumentation.in_context(self.get), path, {**params, "page": number}))
+                # Keep a bounded window of pages in flight so large reports are never held in memory at once.
+                if len(pending) >= self.max_workers:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    def iter_reports(self):
+        """Yield every cost report of the account."""
+        for page in self.iter_pages("/reports"):
+            yield from page.get("reports", [])
+
+    def get_reports(self):
+        """Return the list of all cost reports, across every page."""
+        return list(self.iter_reports())
+
+    def iter_costs(self, report_id, grouping=None, start_date=None, end_date=None):
+        """Stream the cost rows of a report page by page."""
+        params = {"grouping": grouping, "start_date": start_date, "end_date": end_date}
+        params = {key: value for key, value in params.items() if value is not None}
+        for page in self.iter_pages(f"/reports/{report_id}/costs", params):
+            yield from page.get("costs", [])
+
+    def get_costs(self, report_id, grouping=None, start_date=None, end_date=None):
+        """Return the costs of a report in the same shape as the ``/costs`` payload."""
+        return {"costs": list(self.iter_costs(report_id, grouping, start_date, end_date))}
+
+    def close(self):
+        """Release the pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _page_number(url):
+    """Extract the ``page`` query parameter from a pagination link, if any."""
+    if not url:
+        return None
+    page = parse_qs(urlparse(url).query).get("page")
+    return int(page[0]) if page else None